@@ -0,0 +1,85 @@
+"""Cold-start benchmark: how long importing each pipeline module takes.
+
+Each import runs in a fresh interpreter, so nothing is already cached in
+`sys.modules`. Besides wall time, it checks that none of the heavy
+dependencies are pulled in at import time; those should only load once a
+stage is actually constructed.
+
+Run from the repository root:
+    python -m Benchmarks.import_time [--repeat 5] [--budget 1.0]
+
+Exits non-zero if a module imports a heavy dependency or, with `--budget`,
+if its median import time exceeds that many seconds.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import List
+
+MODULES = (
+    "core",
+    "Modules.Critic",
+    "Modules.ResearchAccumulator",
+    "Modules.GapFinder",
+    "Modules.Designer",
+)
+
+# Top-level packages that must not be imported just by importing a module
+HEAVY_DEPENDENCIES = ("llama_index", "chromadb", "torch", "transformers", "openai", "httpx", "PyPDF2")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"seconds": seconds, "heavy": heavy}}))
+"""
+
+def measure(module: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return {
+        "module": module,
+        "median_seconds": statistics.median(run["seconds"] for run in runs),
+        "max_seconds": max(run["seconds"] for run in runs),
+        "heavy": runs[0]["heavy"],
+    }
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module.")
+    parser.add_argument("--budget", type=float, default=None, help="Max median seconds per module.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = [measure(module, args.repeat) for module in MODULES]
+    failed = False
+    for result in results:
+        if "error" in result:
+            failed = True
+        elif result["heavy"] or (args.budget is not None and result["median_seconds"] > args.budget):
+            failed = True
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for result in results:
+            if "error" in result:
+                print(f"{result['module']:<32} ERROR {result['error']}")
+                continue
+            heavy = f"  imports {', '.join(result['heavy'])}" if result["heavy"] else ""
+            print(f"{result['module']:<32} {result['median_seconds'] * 1000:8.1f} ms median "
+                  f"({result['max_seconds'] * 1000:.1f} ms max){heavy}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
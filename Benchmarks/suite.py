@@ -0,0 +1,288 @@
+"""Per-stage and end-to-end benchmarks, scaled over corpus size.
+
+Stages:
+    extraction      PDF text extraction (cold, and served from the extraction cache)
+    ingestion       Chunking + embedding into the Chroma index (`GapFinder._adds_papers_to_store`)
+    retrieval       Top-k paper retrieval on that index (`GapFinder._get_top_k_papers`)
+    prompt_render   `load_prompt` rendering of a file prompt
+    parse_gaps      `response_to_gaps` parsing, with `size` gaps per response
+    end_to_end      One `core.run` loop against the local stub LLM server
+
+Corpora of `size` papers are built by copying the validation PDFs, each copy
+made byte-distinct so caches can't serve one for another. Every LLM call goes to
+`sray_ValidatedLLM/modules/stub_server.py`, so no keys or network are needed
+either; the embedding model must be available locally.
+
+Run from the repository root:
+    python -m Benchmarks.suite [--sizes 10 100 1000] [--stages extraction parse_gaps] [--out results.json]
+
+Write results with `--out` and pass them back as `--baseline` after a change
+(or between releases) to print the per-benchmark difference. Exits non-zero
+if a benchmark fails.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+STAGES = ("extraction", "ingestion", "retrieval", "prompt_render", "parse_gaps", "end_to_end")
+DFT_SIZES = (10, 100, 1000)
+
+VALIDATION_PDF_DIR = "./resources/validation/pdf"
+PROMPT_PATH = "Prompts/metacritic_prompt.txt"
+QUERIES = (
+    "Gaps in evaluating large language models on reasoning tasks",
+    "Data collection strategies for low-resource languages",
+    "Failure modes of retrieval-augmented generation",
+    "Benchmarks for multimodal document understanding",
+)
+
+# Runs one `core.run` loop in a fresh interpreter, so every size starts from
+# an empty index and a fresh critic, and reports its wall time and telemetry
+_END_TO_END_PROBE = """
+import json, time
+import core
+from sray_ValidatedLLM.modules import telemetry
+# Measure the pipeline, not whatever the caches hold: no response, extraction
+# or embedding caches (stub responses must not end up in the real ones either)
+start = time.perf_counter()
+core.run(n_loops=1, telemetry_dir=None, checkpoint_dir=None, persist_dir=None,
+         extraction_cache_dir=None, embedding_cache_path=None, response_cache_path=None,
+         pdf_path={pdf_path!r}, streaming={streaming!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "stages": telemetry.TELEMETRY.summary(by="stage")}}))
+"""
+
+def build_corpus(size: int, corpus_dir: str) -> str:
+    """`size` PDFs in `corpus_dir`, copied round-robin from the validation set.
+
+    Every copy ends in its own PDF comment, so no two files are byte-identical
+    and content-addressed caches can't serve one copy's work for another.
+    """
+    sources = sorted(os.path.abspath(os.path.join(VALIDATION_PDF_DIR, f))
+                     for f in os.listdir(VALIDATION_PDF_DIR) if f.endswith(".pdf"))
+    assert sources, f"No PDFs in {VALIDATION_PDF_DIR}."
+    os.makedirs(corpus_dir, exist_ok=True)
+    for i in range(size):
+        path = os.path.join(corpus_dir, f"paper-{i:05d}.pdf")
+        shutil.copyfile(sources[i % len(sources)], path)
+        with open(path, "ab") as f:
+            f.write(f"\n% Benchmark copy {i}\n".encode())
+    return corpus_dir
+
+def _latencies(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+###########################
+######### STAGES ##########
+###########################
+
+class Bench:
+    """One corpus size's worth of benchmarks; later stages reuse earlier
+    stages' outputs (contexts, the index) instead of rebuilding them."""
+
+    def __init__(self, size: int, work_dir: str, args: argparse.Namespace):
+        self.size = size
+        self.work_dir = work_dir
+        self.args = args
+        self.corpus_dir = build_corpus(size, os.path.join(work_dir, "corpus"))
+        self._contexts = None
+        self._gap_finder = None
+
+    def extraction(self) -> dict:
+        from Modules.ResearchAccumulator import ResearchAccumulator
+        start = time.perf_counter()
+        contexts = ResearchAccumulator(num_workers=self.args.workers, cache_dir=None).accumulate(dir=self.corpus_dir)
+        seconds = time.perf_counter() - start
+
+        # Warm cache: the same corpus again, after one pass has filled the cache
+        ra = ResearchAccumulator(num_workers=self.args.workers, cache_dir=os.path.join(self.work_dir, "extraction"))
+        ra.accumulate(dir=self.corpus_dir)
+        start = time.perf_counter()
+        ResearchAccumulator(num_workers=self.args.workers, cache_dir=ra.cache.cache_dir).accumulate(dir=self.corpus_dir)
+        cached_seconds = time.perf_counter() - start
+
+        self._contexts = contexts
+        return {"seconds": seconds, "papers_per_second": len(contexts) / seconds,
+                "characters": sum(len(ctx.paper_context) for ctx in contexts),
+                "cached_seconds": cached_seconds, "workers": self.args.workers}
+
+    def ingestion(self) -> dict:
+        from Modules.GapFinder import GapFinder
+        from Schemas.Accumulation import Context
+        # Copies of one PDF would otherwise be the same text; make every paper distinct
+        contexts = [Context(paper_id=ctx.paper_id, paper_context=f"Paper {ctx.paper_id}.\n{ctx.paper_context}")
+                    for ctx in self.contexts()]
+        # In memory and uncached, so every chunk is really embedded
+        gap_finder = GapFinder(k=3, init_contexts=[], persist_dir=None, embedding_cache_path=None,
+                               collection_name=f"bench-{self.size}")
+        start = time.perf_counter()
+        gap_finder._adds_papers_to_store(contexts)
+        seconds = time.perf_counter() - start
+
+        self._gap_finder = gap_finder
+        chunks = gap_finder._chroma_collection.count()
+        return {"seconds": seconds, "papers_per_second": len(contexts) / seconds,
+                "chunks": chunks, "chunks_per_paper": chunks / len(contexts), "chunks_per_second": chunks / seconds}
+
+    def retrieval(self) -> dict:
+        if self._gap_finder is None:
+            self.ingestion()
+        samples = []
+        for i in range(self.args.queries):
+            # Distinct text each time; repeated queries would hit the query-embedding memo
+            query = f"{QUERIES[i % len(QUERIES)]} ({i})"
+            start = time.perf_counter()
+            self._gap_finder._get_top_k_papers(query=query, top_k=3)
+            samples.append(time.perf_counter() - start)
+        return {"seconds": sum(samples), "queries": len(samples), **_latencies(samples)}
+
+    def prompt_render(self) -> dict:
+        from sray_ValidatedLLM.modules.llm_funcs import load_prompt
+        # Substitutions grow with the corpus, like the critic's outputs do
+        output = "\n".join(f"Gap {i}: an underexplored direction." for i in range(self.size))
+        substitutions = {"LARGE_OBJECTIVE": "Find gaps.", "FUNC_NAME": "find_gaps", "FUNC_DOCSTRING": "Finds gaps.",
+                         "OUTPUT_TO_CRITIQUE": output, "PREVIOUS_CRITIQUE": "None."}
+        samples = []
+        for _ in range(self.args.iterations):
+            start = time.perf_counter()
+            load_prompt(prompt=PROMPT_PATH, substitutions=substitutions)
+            samples.append(time.perf_counter() - start)
+        return {"seconds": sum(samples), "renders": len(samples), **_latencies(samples)}
+
+    def parse_gaps(self) -> dict:
+        from Modules.GapFinder import response_to_gaps
+        from Schemas.Gaps import Gap
+        # The "accumulate" gap mode's response: one `Gap` repr per chunk
+        response = "---------------------".join(
+            str(Gap(gap_id=i, gap_name=f"Gap {i}", gap_description=f"Nobody has studied case {i}'s \"edge\" yet."))
+            for i in range(1, self.size + 1))
+        samples = []
+        for _ in range(self.args.iterations):
+            start = time.perf_counter()
+            gaps = response_to_gaps(response)
+            samples.append(time.perf_counter() - start)
+        assert len(gaps) == self.size, f"Parsed {len(gaps)} of {self.size} gaps."
+        return {"seconds": sum(samples), "gaps_per_second": self.size * len(samples) / sum(samples),
+                **_latencies(samples)}
+
+    def end_to_end(self) -> dict:
+        proc = subprocess.run([sys.executable, "-c", _END_TO_END_PROBE.format(pdf_path=self.corpus_dir,
+                                                                              streaming=self.args.streaming)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "core.run failed")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        llm = result["stages"]
+        return {"seconds": result["seconds"], "streaming": self.args.streaming,
+                "llm_calls": sum(stage["calls"] for stage in llm.values()),
+                "llm_seconds_by_stage": {name: stage["seconds"] for name, stage in llm.items()}}
+
+    def contexts(self):
+        if self._contexts is None:
+            from Modules.ResearchAccumulator import ResearchAccumulator
+            self._contexts = ResearchAccumulator(num_workers=self.args.workers, cache_dir=None).accumulate(dir=self.corpus_dir)
+        return self._contexts
+
+def run_size(size: int, stages: List[str], args: argparse.Namespace) -> List[dict]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix=f"bench-{size}-") as work_dir:
+        bench = Bench(size, work_dir, args)
+        for stage in stages:
+            fn: Callable[[], dict] = getattr(bench, stage)
+            print(f"> {stage} @ {size} papers...", file=sys.stderr)
+            try:
+                results.append({"stage": stage, "size": size, **fn()})
+            except Exception as e:
+                results.append({"stage": stage, "size": size, "error": f"{type(e).__name__}: {e}"})
+    return results
+
+###########################
+######### REPORTS #########
+###########################
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def compare(results: List[dict], baseline: List[dict]) -> List[str]:
+    """One line per benchmark also in `baseline`: seconds before, after, and the change."""
+    before = {(r["stage"], r["size"]): r for r in baseline if "error" not in r}
+    lines = []
+    for result in results:
+        old = before.get((result["stage"], result["size"]))
+        if old is None or "error" in result:
+            continue
+        change = (result["seconds"] - old["seconds"]) / old["seconds"] * 100 if old["seconds"] else 0.0
+        lines.append(f"{result['stage']:<14} {result['size']:>6} {old['seconds']:>10.3f}s -> {result['seconds']:>10.3f}s "
+                     f"({change:+.1f}%)")
+    return lines
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DFT_SIZES), help="Corpus sizes, in papers.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF extraction processes.")
+    parser.add_argument("--queries", type=int, default=50, help="Retrieval queries per size.")
+    parser.add_argument("--iterations", type=int, default=100, help="Renders/parses per size.")
+    parser.add_argument("--streaming", action="store_true", help="Run `core.run` with the streaming pipeline.")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Seconds per stub LLM request.")
+    parser.add_argument("--out", default=None, help="Write results as JSON to this path.")
+    parser.add_argument("--baseline", default=None, help="Earlier `--out` file to compare against.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args(argv)
+
+    server = None
+    if "end_to_end" in args.stages:
+        from sray_ValidatedLLM.modules.stub_server import StubOpenAIServer
+        # One server for every size; the probes inherit its address from the environment
+        server = StubOpenAIServer(latency=args.stub_latency, seed=0).start()
+        os.environ.update(server.environ())
+
+    results = []
+    try:
+        for size in args.sizes:
+            results += run_size(size, args.stages, args)
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {"meta": {**metadata(), "args": vars(args)}, "results": results}
+    if args.out is not None:
+        if os.path.dirname(args.out):
+            os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        for result in results:
+            if "error" in result:
+                print(f"{result['stage']:<14} {result['size']:>6}  ERROR {result['error']}")
+                continue
+            print(f"{result['stage']:<14} {result['size']:>6} {result['seconds']:>10.3f}s")
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            print("\n".join(compare(results, json.load(f)["results"])))
+    return 1 if any("error" in result for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Callable, Optional, Sequence, Tuple, TypeVar
+
+# Bump whenever a stage's output format changes so stale checkpoints are never served
+CHECKPOINT_VERSION = "1"
+
+DFT_CHECKPOINT_DIR = ".cache/checkpoints"
+
+T = TypeVar("T")
+
+def _canonical(obj: Any) -> Any:
+    # A JSON-able stand-in for `obj` that only depends on its content
+    if hasattr(obj, "model_dump"):
+        try:
+            return obj.model_dump(mode="json")
+        except Exception:
+            # e.g. models wrapping raw SDK objects
+            return str(obj)
+    if isinstance(obj, dict):
+        return {str(key): _canonical(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+def config_fingerprint(config: Any, files: Sequence[str] = ()) -> str:
+    """SHA-256 of `config` and the contents of `files`, e.g. the model, its
+    endpoint and every prompt. Add it to a stage's inputs so changing any of
+    them invalidates its checkpoints."""
+    digest = hashlib.sha256(json.dumps(_canonical(config), sort_keys=True).encode())
+    for path in sorted(files):
+        digest.update(path.encode())
+        try:
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+class CheckpointStore:
+    """On-disk checkpoints of `core.run` stage outputs.
+
+    Entries are keyed by the SHA-256 of the stage name and the stage's inputs
+    (pydantic models by content), so a rerun serves every stage whose inputs
+    haven't changed and recomputes from the first one whose inputs have.
+    Outputs are pickled and written atomically, so an interrupted run never
+    leaves a truncated checkpoint behind.
+    """
+
+    def __init__(self, checkpoint_dir: str = DFT_CHECKPOINT_DIR, version: str = CHECKPOINT_VERSION):
+        self.checkpoint_dir = checkpoint_dir
+        self.version = version
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, stage: str, inputs: Any) -> str:
+        payload = json.dumps([stage, self.version, _canonical(inputs)], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, stage: str, key: str) -> Tuple[bool, Any]:
+        """Returns `(True, output)` for a checkpoint, `(False, None)` on a miss."""
+        try:
+            with open(self._path(stage, key), 'rb') as f:
+                output = pickle.load(f)
+        except Exception:
+            # Missing, truncated, or pickled from classes that have since
+            # moved or changed: recompute rather than fail the run
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, output
+
+    def put(self, stage: str, key: str, output: Any) -> None:
+        path = self._path(stage, key)
+        # Write atomically so a crash never leaves a truncated entry behind
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(output, f)
+        os.replace(tmp_path, path)
+
+    def run(self, stage: str, inputs: Any, fn: Callable[[], T],
+            on_resume: Optional[Callable[[T], None]] = None) -> T:
+        """Returns the checkpointed output of `stage` for `inputs`, or computes
+        it with `fn()` and checkpoints it.
+
+        Args:
+            stage (str): Stage name; also names the checkpoint file.
+            inputs (Any): Everything the output depends on, e.g. the upstream
+                outputs and the loop number.
+            fn (Callable[[], T]): Computes the output on a miss.
+            on_resume (Optional[Callable[[T], None]]): Called with the output on
+                a hit, to restore side effects `fn` would have had (e.g. dedup
+                state).
+        """
+        key = self.key_for(stage, inputs)
+        hit, output = self.get(stage, key)
+        if hit:
+            print(f"Resuming '{stage}' from checkpoint {key[:12]}.")
+            if on_resume is not None:
+                on_resume(output)
+            return output
+        output = fn()
+        self.put(stage, key, output)
+        return output
+
+    def clear(self) -> None:
+        for name in os.listdir(self.checkpoint_dir):
+            if name.endswith(".pkl"):
+                os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{stage}-{key}.pkl")
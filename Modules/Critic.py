@@ -1,9 +1,11 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
 from functools import wraps
 from pprint import pprint
 import sys
-from typing import Callable, Type
-from sray_ValidatedLLM.modules.llm_funcs import load_prompt, prompt_LLM
-from sray_ValidatedLLM.modules.utilities import configure_openai
+import threading
+from typing import Callable, List, Optional, Tuple, Type
+from sray_ValidatedLLM.modules import telemetry
 
 class Critic:
     Critique = str
@@ -14,13 +16,38 @@ class Critic:
         Each of these functions serves a unique purpose for a greater system that extracts information from existing research topics, finds gaps in the research, and designs experiments to fill those gaps.
         """
 
-    def __init__(self, prompt_mapping: dict[str, str], **kwargs):
+    def __init__(self, prompt_mapping: dict[str, str], background: bool = False, max_workers: int = 2, **kwargs):
         self._supported_keys = list(prompt_mapping.keys())
         self._prompt_mapping = prompt_mapping
         # Initialize punishments or other payload settings, if needed
         self._critiques = {key: [""] for key in self._supported_keys}
-        # DEBUG: Uncomment eventually
-        self.client, self.model_id = configure_openai(model_id_to_use=None, client_host="openai")
+        # The LLM client is configured on the first critique, so constructing a
+        # Critic (and importing `core`) is cheap and needs no API keys
+        self._client = None
+        self._model_id = None
+        self._client_lock = threading.Lock()
+        # In background mode critiques run on worker threads and wrapped
+        # functions return immediately; `flush`/`chastise` collect them.
+        self.background = background
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="critic") if background else None
+        self._pending: List[Tuple[str, Future]] = []
+
+    @property
+    def client(self):
+        self._configure_client()
+        return self._client
+
+    @property
+    def model_id(self) -> str:
+        self._configure_client()
+        return self._model_id
+
+    def _configure_client(self) -> None:
+        # Background critiques may race to get here first
+        with self._client_lock:
+            if self._client is None:
+                from sray_ValidatedLLM.modules.utilities import configure_openai
+                self._client, self._model_id = configure_openai(model_id_to_use=None, client_host="openai")
 
     def overwatch(self, func: Callable) -> Callable:
         @wraps(func)
@@ -29,47 +56,113 @@ class Critic:
             caller = func.__name__
             assert caller in self._supported_keys, f"Caller '{caller}' not supported."
 
-            # Execute the original function and get the output
-            output = func(*args, **kwargs)
-
-            # Prepare information for critiquing
-            func_name = func.__name__
-            func_docstring = func.__doc__ or "No docstring provided."
-            previous_critique = self._get_previous_critique(func_name)
-            
-            # Generate the prompt for the critique using the docstring and previous critiques
-            prompt = (
-                "Here is the relevant information for your critique:\n"
-                f"---------------------\n"
-                f"Function Name: {func_name}\n"
-                f"Docstring:\n{func_docstring}\n\n"
-                f"Previous Critique: {previous_critique}\n\n"
-                f"Latest Output:\n{output}\n"
-            )
-
-            META_CRITIC_PROMPT = load_prompt(prompt="Prompts/metacritic_prompt.txt",
-                                     substitutions={
-                                         'LARGE_OBJECTIVE': Critic.LARGE_OBJECTIVE,
-                                         'FUNC_NAME': func_name,
-                                         'FUNC_DOCSTRING': func_docstring,
-                                         "OUTPUT_TO_CRITIQUE": output,
-                                         "PREVIOUS_CRITIQUE": previous_critique
-                                     })
-
-            # Call the LLM with the prompt to get the critique
+            # Execute the original function and get the output; its LLM calls
+            # are attributed to it in `telemetry`
+            with telemetry.stage(caller):
+                output = func(*args, **kwargs)
+
+            self.review(func, output)
+            return output
+
+        return wrapper
+
+    def review(self, func: Callable, output) -> None:
+        """Critiques `output` as if `func` had just returned it. For outputs
+        produced outside the wrapped function, e.g. collected item by item by
+        a streaming stage and critiqued once per loop.
+
+        Args:
+            func (Callable): A supported function (wrapped or not); its name and
+                docstring are what the critique is about.
+            output: What to critique.
+        """
+        # Prepare information for critiquing
+        func_name = func.__name__
+        assert func_name in self._supported_keys, f"Caller '{func_name}' not supported."
+        func_docstring = func.__doc__ or "No docstring provided."
+        previous_critique = self._get_previous_critique(func_name)
+
+        if self.background:
+            # NOTE: `previous_critique` is whatever had been collected at submit time
+            # Run in a copy of this context so telemetry still knows the `core.run` loop
+            future = self._executor.submit(copy_context().run, self._critique,
+                                           func_name, func_docstring, output, previous_critique)
+            self._pending.append((func_name, future))
+            return
+
+        latest_critique = self._critique(func_name, func_docstring, output, previous_critique)
+        self._report_critique(func_name, latest_critique)
+
+    def _critique(self, func_name: str, func_docstring: str, output, previous_critique: Critique) -> Critique:
+        # Deferred with the client; pulls in the openai SDK
+        from sray_ValidatedLLM.modules.llm_funcs import load_prompt, prompt_LLM
+
+        # Generate the prompt for the critique using the docstring and previous critiques
+        prompt = (
+            "Here is the relevant information for your critique:\n"
+            f"---------------------\n"
+            f"Function Name: {func_name}\n"
+            f"Docstring:\n{func_docstring}\n\n"
+            f"Previous Critique: {previous_critique}\n\n"
+            f"Latest Output:\n{output}\n"
+        )
+
+        META_CRITIC_PROMPT = load_prompt(prompt="Prompts/metacritic_prompt.txt",
+                                 substitutions={
+                                     'LARGE_OBJECTIVE': Critic.LARGE_OBJECTIVE,
+                                     'FUNC_NAME': func_name,
+                                     'FUNC_DOCSTRING': func_docstring,
+                                     "OUTPUT_TO_CRITIQUE": output,
+                                     "PREVIOUS_CRITIQUE": previous_critique
+                                 })
+
+        # Call the LLM with the prompt to get the critique
+        with telemetry.stage(f"critic:{func_name}"):
             latest_critique = prompt_LLM(self.client, self.model_id, prompt,
                                          desired_format=None, max_tokens=512,
                                          force_raw=True, validate_func=None, num_retry=1,
                                          system_prompt=META_CRITIC_PROMPT)
-            self._store_critique(func_name, latest_critique)
+        return latest_critique
 
-            # Output the critique for user feedback, but this could also be logged
-            print(f"\033[93mCritique for {func_name}:\n{latest_critique}\033[0m\n")
-            print("\n\n")
+    def _report_critique(self, func_name: str, latest_critique: Critique) -> None:
+        self._store_critique(func_name, latest_critique)
 
-            return output
+        # Output the critique for user feedback, but this could also be logged
+        print(f"\033[93mCritique for {func_name}:\n{latest_critique}\033[0m\n")
+        print("\n\n")
 
-        return wrapper
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Waits for every outstanding background critique and stores them in
+        the order they were submitted. A no-op when not in background mode.
+
+        Args:
+            timeout (Optional[float]): Max seconds to wait per critique.
+        """
+        pending, self._pending = self._pending, []
+        for func_name, future in pending:
+            try:
+                latest_critique = future.result(timeout=timeout)
+            except Exception as e:
+                print(f"\033[91mCritique for {func_name} failed: {type(e).__name__} {e}\033[0m\n")
+                continue
+            self._report_critique(func_name, latest_critique)
+
+    def discard(self, timeout: Optional[float] = None) -> None:
+        """Drops every outstanding background critique without storing it, e.g.
+        before `restore`-ing checkpointed critiques that already cover them.
+        Critiques not yet started are cancelled; running ones are waited for,
+        so none lands after the restore.
+
+        Args:
+            timeout (Optional[float]): Max seconds to wait per critique.
+        """
+        pending, self._pending = self._pending, []
+        for _, future in pending:
+            if not future.cancel():
+                try:
+                    future.result(timeout=timeout)
+                except Exception:
+                    pass
 
     @staticmethod
     def example_critic_func(previous_critique: Critique, latest_response: str) -> Critique:
@@ -78,11 +171,21 @@ class Critic:
         return latest_response if latest_response else "No new critique available."
 
     def chastise(self) -> None:
+        # Critiques must all be in before they can be acted upon
+        self.flush()
         # Update the corresponding prompt for each function with the additional critique
         # TODO: Need to abstract away the prompts and in-memory update the prompts according to the define prompt mapping.
         # Perhaps store all the critiques and configuration in a separate file/folder.
         pass
     
+    def snapshot(self) -> dict:
+        """A copy of every stored critique, e.g. to checkpoint between loops."""
+        return {func_name: list(critiques) for func_name, critiques in self._critiques.items()}
+
+    def restore(self, snapshot: dict) -> None:
+        """Replaces the stored critiques with a `snapshot`."""
+        self._critiques = {func_name: list(critiques) for func_name, critiques in snapshot.items()}
+
     def _get_previous_critique(self, func_name: str) -> Critique:
         # Retrieve the last critique if available
         return self._critiques.get(func_name, ["No previous critique. You can safely ignore this."])[-1]
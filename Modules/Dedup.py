@@ -0,0 +1,91 @@
+import threading
+from typing import Callable, List, Optional, TypeVar
+
+import numpy as np
+
+from Modules.Defaults import DFT_SIMILARITY_THRESHOLD
+
+T = TypeVar("T")
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def cluster_by_similarity(embeddings: np.ndarray, threshold: float = DFT_SIMILARITY_THRESHOLD) -> List[List[int]]:
+    """Groups near-duplicate rows of `embeddings`.
+
+    Greedy leader clustering: walking in input order, each row that isn't in
+    a cluster yet starts one and pulls in every unassigned row at least
+    `threshold` cosine-similar to it. The pairwise similarities are a single
+    matrix product.
+
+    Returns:
+        List[List[int]]: Row indices per cluster, leader first, in input order.
+    """
+    if len(embeddings) == 0:
+        return []
+    unit = _normalize(np.asarray(embeddings, dtype=np.float32))
+    similar = (unit @ unit.T) >= threshold
+    assigned = np.zeros(len(unit), dtype=bool)
+    clusters = []
+    for i in range(len(unit)):
+        if assigned[i]:
+            continue
+        members = np.flatnonzero(similar[i] & ~assigned)
+        assigned[members] = True
+        # `i` is always similar to itself, so it leads its own cluster
+        clusters.append([i] + [int(j) for j in members if j != i])
+    return clusters
+
+class SemanticDeduplicator:
+    """Drops items whose text is a near-duplicate of another item's.
+
+    Within a call, one representative (the first) is kept per cluster of
+    near-duplicates. With `remember`, the representatives are also kept
+    across calls, so an item that repeats one forwarded earlier (e.g. in a
+    previous `core.run` loop) is dropped too.
+    """
+
+    def __init__(self, embed_model, threshold: float = DFT_SIMILARITY_THRESHOLD, remember: bool = True):
+        assert 0 < threshold <= 1, "threshold must be in (0, 1]."
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.remember = remember
+        self._seen: Optional[np.ndarray] = None
+        # Streaming stages may dedup from several threads at once
+        self._lock = threading.Lock()
+        self.stats = {"received": 0, "forwarded": 0, "merged": 0, "repeats": 0}
+
+    def dedup(self, items: List[T], key: Callable[[T], str]) -> List[T]:
+        if not items:
+            return []
+        unit = _normalize(np.asarray(self.embed_model.get_text_embedding_batch([key(item) for item in items]),
+                                     dtype=np.float32))
+
+        with self._lock:
+            # Repeats of something already forwarded in an earlier call
+            novel = np.ones(len(items), dtype=bool)
+            if self._seen is not None:
+                novel = (unit @ self._seen.T).max(axis=1) < self.threshold
+            candidates = np.flatnonzero(novel)
+
+            clusters = cluster_by_similarity(unit[candidates], self.threshold)
+            keep = sorted(int(candidates[cluster[0]]) for cluster in clusters)
+            if self.remember and keep:
+                self._seen = unit[keep] if self._seen is None else np.vstack([self._seen, unit[keep]])
+
+            self.stats["received"] += len(items)
+            self.stats["forwarded"] += len(keep)
+            self.stats["merged"] += len(candidates) - len(keep)
+            self.stats["repeats"] += len(items) - len(candidates)
+        return [items[i] for i in keep]
+
+    def remember_items(self, items: List[T], key: Callable[[T], str]) -> None:
+        """Marks `items` as already forwarded without deduplicating them, e.g.
+        to restore the state of a run resumed from a checkpoint."""
+        if not items or not self.remember:
+            return
+        unit = _normalize(np.asarray(self.embed_model.get_text_embedding_batch([key(item) for item in items]),
+                                     dtype=np.float32))
+        with self._lock:
+            self._seen = unit if self._seen is None else np.vstack([self._seen, unit])
@@ -0,0 +1,26 @@
+# Defaults shared by modules whose heavy dependencies (llama_index, chromadb,
+# torch) are imported lazily. Kept dependency-free so default arguments can
+# reference them without paying for those imports.
+
+# llama_index LLM behind `GapFinder` and `Designer`; any model llama_index
+# knows the context window of
+DFT_LLM_MODEL = "gpt-4o-mini"
+
+# Default on-disk location for a persistent GapFinder index (see `persist_dir`)
+DFT_PERSIST_DIR = ".cache/chroma"
+
+# Embedding cache (SEE `Modules/EmbeddingCache.py`)
+DFT_EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite"
+# Up from the llama_index default of 10; amortizes per-call overhead on CPU
+DFT_EMBED_BATCH_SIZE = 32
+DFT_QUERY_CACHE_SIZE = 1024
+
+# Semantic dedup (SEE `Modules/Dedup.py`): cosine similarity above which two
+# texts count as the same item. bge-small scores paraphrases of one idea
+# around 0.9 and up, merely related ideas well below.
+DFT_SIMILARITY_THRESHOLD = 0.9
+
+# Chunking (SEE `Modules/PaperChunker.py`), in tokens. Bigger chunks mean
+# fewer embeddings and faster retrieval, smaller ones more precise recall.
+DFT_CHUNK_SIZE = 1024
+DFT_CHUNK_OVERLAP = 128
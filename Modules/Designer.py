@@ -1,34 +1,19 @@
 import os
-from typing import List
-
-from llama_index.llms.openai import OpenAI
-from llama_index.core.prompts import PromptTemplate
+from typing import List, Optional
 
+from Modules.Defaults import DFT_LLM_MODEL
 from Schemas.Gaps import Hypothesis
 from core import critic
+from sray_ValidatedLLM.modules import telemetry
+from sray_ValidatedLLM.modules.concurrency import RateLimiter, gather_bounded, run_sync
+from sray_ValidatedLLM.modules.telemetry import instrument_llama_index
+from sray_ValidatedLLM.modules.utilities import estimate_tokens, fmt, shared_http_client
 
-class Designer:
-    def __init__(self, hypotheses: List[Hypothesis], **kwargs):
-        self.hypotheses = hypotheses
-        self.designer = OpenAI(model="gpt-4o-mini")
-    
-    @critic.overwatch
-    def design_experiments(self, hypotheses: List[Hypothesis], **kwargs) -> List[str]:
-        """This function takes in a list of hypotheses and designs experiments for each hypothesis.
-        The output of this function will be used by researchers to design experiments. As a resulting,
-        each designed experiment should be as detailed, grounded, and actionable as possible. It's important
-        to make sure that the designed experiments are specific to the hypothesis and are not generic.
-
-        Args:
-            hypotheses (List[Hypothesis]): These are the hypotheses for which experiments need to be designed.
+# Completion tokens charged against the token budget per design, up front
+DFT_COMPLETION_TOKEN_ESTIMATE = 1024
 
-        Returns:
-            List[str]: These are the list of designed experiments for each hypothesis.
-        """        
-        
-        # TODO: ABSTRACT THIS AWAY
-        prompt_tmpl = PromptTemplate(
-            """
+# Fingerprinted into `core.run`'s checkpoint keys (SEE `config`)
+DESIGN_PROMPT = """
             Given the following hypothesis:
 
             Hypothesis Name: {hypothesis_name}
@@ -51,21 +36,99 @@ class Designer:
              Please be as specific as possible.
 
             """
-        )
+
+class Designer:
+    def __init__(self, hypotheses: List[Hypothesis],
+                 max_concurrency: int = 1,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 llm_model: str = DFT_LLM_MODEL,
+                 **kwargs):
+        # Imported here rather than at module level; llama_index is slow to import
+        from llama_index.llms.openai import OpenAI
+
+        # Token/latency accounting for every llama_index LLM call
+        instrument_llama_index()
+
+        self.hypotheses = hypotheses
+        # Shares warm connections with every other LLM client in the process
+        self.designer = OpenAI(model=llm_model,
+                               http_client=shared_http_client(),
+                               async_http_client=shared_http_client(is_async=True))
+        # Max designs in flight at once; 1 runs them one after another
+        assert isinstance(max_concurrency, int) and max_concurrency > 0, "max_concurrency must be a positive integer."
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute=requests_per_minute,
+                                        tokens_per_minute=tokens_per_minute)
+        # Per-design timeout in seconds; a timed-out design is dropped, not fatal
+        self.timeout = timeout
+    
+    @critic.overwatch
+    def design_experiments(self, hypotheses: List[Hypothesis], **kwargs) -> List[Optional[str]]:
+        """This function takes in a list of hypotheses and designs experiments for each hypothesis.
+        The output of this function will be used by researchers to design experiments. As a resulting,
+        each designed experiment should be as detailed, grounded, and actionable as possible. It's important
+        to make sure that the designed experiments are specific to the hypothesis and are not generic.
+
+        Args:
+            hypotheses (List[Hypothesis]): These are the hypotheses for which experiments need to be designed.
+
+        Returns:
+            List[Optional[str]]: These are the list of designed experiments for each hypothesis, one per
+                hypothesis and in the same order. None where the design failed or timed out.
+        """
+        return self._design_experiments(hypotheses)
+
+    def _design_experiments(self, hypotheses: List[Hypothesis]) -> List[Optional[str]]:
+        # `design_experiments` without the critic, for per-item streaming stages
+        from llama_index.core.prompts import PromptTemplate
+        
+        prompt_tmpl = PromptTemplate(DESIGN_PROMPT)
         
-        def _design(hypothesis: Hypothesis) -> str:
-            return self.designer.complete(
-                prompt_tmpl.format(
-                    hypothesis_name=hypothesis.hypothesis_name,
-                    hypothesis_description=hypothesis.hypothesis_description
-                )
+        prompts = [
+            prompt_tmpl.format(
+                hypothesis_name=hypothesis.hypothesis_name,
+                hypothesis_description=hypothesis.hypothesis_description
             )
-
-        return [_design(hypothesis) for hypothesis in hypotheses]
+            for hypothesis in hypotheses
+        ]
+
+        async def _design(prompt: str) -> str:
+            return await self.designer.acomplete(prompt)
+
+        results = run_sync(gather_bounded(
+            [lambda prompt=prompt: _design(prompt) for prompt in prompts],
+            max_concurrency=self.max_concurrency,
+            rate_limiter=self.rate_limiter,
+            timeout=self.timeout,
+            token_costs=[estimate_tokens(prompt) + DFT_COMPLETION_TOKEN_ESTIMATE for prompt in prompts],
+        ))
+
+        # Keep whatever finished; failures and timeouts are reported and left as
+        # None, so designs stay aligned with hypotheses
+        designs = []
+        for hypothesis, result in zip(hypotheses, results):
+            if isinstance(result, BaseException):
+                print(fmt(f"Design failed for hypothesis {hypothesis.hypothesis_id}: {type(result).__name__} {result}", n="red"))
+                result = None
+            designs.append(result)
+        return designs
     
 
-    def core(self) -> List[str]:
-        return self.design_experiments(self.hypotheses)
+    def hypothesis_to_designs(self, hypothesis: Hypothesis) -> List[str]:
+        """Designs the experiments for one hypothesis, for `Modules/Pipeline.py`
+        stages; empty if the design failed. Not critiqued per item (SEE
+        `Critic.review`)."""
+        with telemetry.stage("design_experiments"):
+            return [design for design in self._design_experiments([hypothesis]) if design is not None]
+
+    def config(self) -> dict:
+        """Every setting that changes what designs come out, for checkpoint keys."""
+        return {"llm_model": self.designer.model, "api_base": self.designer.api_base, "prompt": DESIGN_PROMPT}
+
+    def core(self, hypotheses: Optional[List[Hypothesis]] = None) -> List[Optional[str]]:
+        return self.design_experiments(self.hypotheses if hypotheses is None else hypotheses)
     
 
 if __name__ == '__main__':
@@ -78,7 +141,7 @@ if __name__ == '__main__':
     
     
     from Modules.ResearchAccumulator import ResearchAccumulator
-    from Modules.GapFinder import GapFinder
+    from Modules.GapFinder import DFT_PERSIST_DIR, GapFinder
 
     # Load research from PDFs
     pdf_path = "./resources/validation/pdf"
@@ -86,7 +149,7 @@ if __name__ == '__main__':
     ctxs = ra.accumulate(dir=pdf_path)
 
     # Run the gap finder
-    gap_finder = GapFinder(init_contexts=ctxs, k=3, hypothesis_use_index=True)
+    gap_finder = GapFinder(init_contexts=ctxs, k=3, hypothesis_use_index=True, persist_dir=DFT_PERSIST_DIR)
     hyp = gap_finder.core([])
 
     # Run the designer
@@ -95,4 +158,7 @@ if __name__ == '__main__':
 
     for d in designs:
         print(d)
-        print() 
+        print()
+
+    # Critiques may still be running in the background
+    critic.flush()
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from Modules.Defaults import DFT_EMBED_BATCH_SIZE, DFT_EMBEDDING_CACHE_PATH as DFT_CACHE_PATH, DFT_QUERY_CACHE_SIZE
+
+# Keep well under SQLite's bound-parameter limit
+_SQL_BATCH = 500
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps another embedding model with batching and caching.
+
+    - Texts are embedded `embed_batch_size` at a time, and only the ones that
+      aren't cached yet reach the underlying model.
+    - Vectors are persisted in SQLite keyed by (model name, text hash), so a
+      chunk is never embedded twice across runs.
+    - Query embeddings are additionally memoized in an in-memory LRU, since
+      the same gap/hypothesis text is queried over and over.
+
+    `stats()` reports hit rates and throughput (chunks/sec) of the underlying
+    model for machine sizing.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _conn: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr()
+    _query_memo: Any = PrivateAttr()
+    _query_cache_size: int = PrivateAttr()
+    _stats: Dict[str, float] = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding,
+                 cache_path: Optional[str] = DFT_CACHE_PATH,
+                 embed_batch_size: int = DFT_EMBED_BATCH_SIZE,
+                 query_cache_size: int = DFT_QUERY_CACHE_SIZE,
+                 **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=embed_batch_size, **kwargs)
+        inner.embed_batch_size = embed_batch_size
+        self._inner = inner
+        self._lock = threading.Lock()
+        self._query_memo = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._stats = {"text_hits": 0, "text_misses": 0, "query_hits": 0, "query_misses": 0,
+                       "chunks_embedded": 0, "embed_seconds": 0.0}
+
+        # None disables the on-disk tier
+        if cache_path is not None:
+            if os.path.dirname(cache_path):
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._conn.commit()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    ###########################
+    ######### QUERIES #########
+    ###########################
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        with self._lock:
+            if query in self._query_memo:
+                self._query_memo.move_to_end(query)
+                self._stats["query_hits"] += 1
+                return self._query_memo[query]
+
+        # Queries may be embedded differently from documents (e.g. bge's query
+        # instruction), so they get their own namespace on disk
+        key = self._key(query, kind="query")
+        embedding = self._load([key]).get(key)
+        hit = embedding is not None
+        if not hit:
+            embedding = self._inner.get_query_embedding(query)
+            self._store({key: embedding})
+
+        with self._lock:
+            self._stats["query_hits" if hit else "query_misses"] += 1
+            self._query_memo[query] = embedding
+            if len(self._query_memo) > self._query_cache_size:
+                self._query_memo.popitem(last=False)
+        return embedding
+
+    # The async variants run the model and the SQLite I/O on a worker thread,
+    # so they never block the event loop other LLM calls share
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    ###########################
+    ########## TEXTS ##########
+    ###########################
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys = [self._key(text, kind="text") for text in texts]
+        cached = self._load(keys)
+
+        # Deduplicate within the batch too, e.g. boilerplate repeated across papers
+        misses = {key: text for key, text in zip(keys, texts) if key not in cached}
+        with self._lock:
+            self._stats["text_hits"] += len(texts) - len(misses)
+            self._stats["text_misses"] += len(misses)
+        if misses:
+            start = time.perf_counter()
+            embeddings = self._inner.get_text_embedding_batch(list(misses.values()))
+            with self._lock:
+                self._stats["embed_seconds"] += time.perf_counter() - start
+                self._stats["chunks_embedded"] += len(misses)
+            fresh = dict(zip(misses.keys(), embeddings))
+            self._store(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    ###########################
+    ######### HELPERS #########
+    ###########################
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        seconds = stats["embed_seconds"]
+        stats["chunks_per_sec"] = stats["chunks_embedded"] / seconds if seconds else 0.0
+        lookups = stats["text_hits"] + stats["text_misses"]
+        stats["text_hit_rate"] = stats["text_hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _key(self, text: str, kind: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self, keys: List[str]) -> Dict[str, Embedding]:
+        if self._conn is None or not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('d', blob).tolist()
+        return found
+
+    def _store(self, embeddings: Dict[str, Embedding]) -> None:
+        if self._conn is None or not embeddings:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array('d', vector).tobytes()) for key, vector in embeddings.items()],
+            )
+            self._conn.commit()
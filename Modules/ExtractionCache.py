@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+# Bump whenever the extraction logic changes so stale entries are never served
+EXTRACTOR_VERSION = "pypdf2-1"
+
+DFT_CACHE_DIR = ".cache/extraction"
+DFT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+class ExtractionCache:
+    """On-disk cache of extracted PDF text.
+
+    Entries are keyed by the SHA-256 of the file content plus the extractor
+    version, so renamed or copied PDFs still hit and edited PDFs miss. Each
+    entry stores the full text and the character offset at which every page
+    starts. The directory is capped at `max_bytes`; the least recently used
+    entries (by file mtime, bumped on every hit) are evicted first.
+    """
+
+    def __init__(self, cache_dir: str = DFT_CACHE_DIR,
+                 max_bytes: int = DFT_CACHE_MAX_BYTES,
+                 extractor_version: str = EXTRACTOR_VERSION):
+        assert isinstance(max_bytes, int) and max_bytes > 0, "max_bytes must be a positive integer."
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extractor_version = extractor_version
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = sum(os.path.getsize(path) for path in self._entry_paths())
+
+    ###########################
+    ######### LOOKUPS #########
+    ###########################
+
+    def key_for(self, pdf_path: str) -> str:
+        """Content hash of `pdf_path` combined with the extractor version."""
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return f"{digest.hexdigest()}-{self.extractor_version}"
+
+    def get(self, key: str) -> Optional[Tuple[str, List[int]]]:
+        """Returns `(text, page_offsets)` for `key`, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        # Bump recency for LRU eviction
+        os.utime(path)
+        self.hits += 1
+        return entry["text"], entry["page_offsets"]
+
+    def put(self, key: str, text: str, page_offsets: List[int]) -> None:
+        path = self._path(key)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # Write atomically so a crash never leaves a truncated entry behind
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"text": text, "page_offsets": page_offsets}, f)
+        os.replace(tmp_path, path)
+
+        self._size += os.path.getsize(path) - previous_size
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entry_paths()),
+            "bytes": self._size,
+        }
+
+    ###########################
+    ######### HELPERS #########
+    ###########################
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _entry_paths(self) -> List[str]:
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.json')]
+
+    def _evict(self) -> None:
+        # Oldest access first
+        entries = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in self._entry_paths()))
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            os.remove(path)
+            self._size -= size
+            self.evictions += 1
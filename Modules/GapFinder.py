@@ -1,26 +1,101 @@
+import ast
+import os
 import re
-from typing import List, Type
-
-import chromadb
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core import Document, VectorStoreIndex
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import VectorStoreIndex
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter, TokenTextSplitter
-from llama_index.llms.openai import OpenAI
-from llama_index.core.prompts import PromptTemplate
+import threading
+import time
+import uuid
+from collections import defaultdict
+from itertools import count, islice
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Type
+
+# NOTE: chromadb, llama_index and the HuggingFace embedding stack take
+# seconds to import, so they are imported where they're first used.
+if TYPE_CHECKING:
+    from llama_index.core import Document
 
 # from Modules import Critic
-from Schemas.Accumulation import Context
-from Schemas.Gaps import ExperimentalDesign, Hypothesis, Gap
+from Modules.Defaults import (DFT_CHUNK_OVERLAP, DFT_CHUNK_SIZE, DFT_EMBED_BATCH_SIZE, DFT_EMBEDDING_CACHE_PATH,
+                              DFT_LLM_MODEL, DFT_PERSIST_DIR, DFT_SIMILARITY_THRESHOLD)
+from Schemas.Accumulation import Context, IngestionRecord, Page
+from Schemas.Gaps import ExperimentalDesign, Hypothesis, Gap, GapList
 from core import critic
+from sray_ValidatedLLM.modules import telemetry
+from sray_ValidatedLLM.modules.concurrency import RateLimiter, gather_bounded, run_sync
+from sray_ValidatedLLM.modules.telemetry import instrument_llama_index
+from sray_ValidatedLLM.modules.utilities import estimate_tokens, fmt, shared_http_client
 
 # TODO: What's our vector store interface?
 
+# Prompt tokens allowed per LLM call in the "map_reduce" gap mode
+DFT_MAX_TOKENS_PER_CALL = 8000
+
+# Chunks retrieved per requested paper before pooling chunk scores by paper
+DFT_CHUNKS_PER_PAPER = 8
+
+# Prompts (also fingerprinted into `core.run`'s checkpoint keys; SEE `config`)
+GAP_FINDER_PROMPT = """
+        Please identify potential research gaps, opportunities, or areas for further investigation based on the given papers. Please include citations for each claimed gap. Be as specific as possible.
+        """
+HYPOTHESIS_PROMPT = """
+            Can you please help me generate a research hypothesis based on the following research gap that we've identified?
+
+            A hypothesis may include the following:
+             - A proposed explanation for a phenomenon
+             - A proposed novel approach for solving a problem
+             - A novel algorithm, method, or combination of methods
+             - A novel problem formulation
+
+            Please be as specific as possible. Here is the research gap:
+
+            {gap_description}
+            """
+# "map_reduce" gap mode: per-paper extraction, then merging
+MAP_PROMPT = """
+            {instructions}
+
+            Only consider the following excerpt from paper {paper_id}, and cite it as paper {paper_id}.
+            ---------------------
+            {paper_text}
+            ---------------------
+            """
+REDUCE_PROMPT = """
+            The following research gaps were identified independently in different papers.
+            Merge gaps that describe the same underlying problem into one, keeping every citation.
+            Keep distinct gaps separate. Do not invent new gaps.
+            ---------------------
+            {gap_list}
+            ---------------------
+            """
+PROMPTS = (GAP_FINDER_PROMPT, HYPOTHESIS_PROMPT, MAP_PROMPT, REDUCE_PROMPT)
+
+# Stable document ids let the ingestion docstore recognize a paper (or page)
+# it has already embedded and compare content hashes instead of re-embedding.
+def _context_to_document(ctx: Context) -> "Document":
+    from llama_index.core import Document
+    return Document(id_=f"paper-{ctx.paper_id}", text=ctx.paper_context,
+                    metadata={"paper_id": ctx.paper_id})
+
+# Whole-paper documents, as opposed to the pages from `add_page_stream`
+_PAPER_DOC_ID = re.compile(r"paper-\d+")
+_PAGE_DOC_ID = re.compile(r"paper-(\d+)-page-\d+")
+
+def _page_to_document(page: Page) -> "Document":
+    from llama_index.core import Document
+    return Document(id_=f"paper-{page.paper_id}-page-{page.page_num}", text=page.page_text,
+                    metadata={"paper_id": page.paper_id, "page": page.page_num})
+
+# A Python string literal as printed by repr(): '...' or "...", with escapes
+_STR_LITERAL = r"""('(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")"""
+_GAP_ID = re.compile(r"gap_id=(\d+)")
+_GAP_NAME = re.compile(r"gap_name=" + _STR_LITERAL)
+_GAP_DESCRIPTION = re.compile(r"gap_description=" + _STR_LITERAL)
+
 def response_to_gaps(input_string: str) -> List[Gap]:
     """Converts the response from the LLM to a list of gaps.
 
+    Used by the "accumulate" gap mode, whose response is the repr of one
+    `Gap` per chunk. Chunks that can't be parsed are reported and skipped.
+
     Args:
         response (str): The response from the LLM.
 
@@ -31,33 +106,149 @@ def response_to_gaps(input_string: str) -> List[Gap]:
     
     gaps = []
     for response in responses:
-        # Extract the values using regular expressions
-        gap_id = int(re.search(r'gap_id=(\d+)', response).group(1))
-        gap_name = re.search(r"gap_name='([^']*)'", response).group(1)
-        gap_description = re.search(r"gap_description='([^']*)'", response).group(1)
+        # Extract the values using regular expressions; repr() switches to
+        # double quotes (or escapes) when a value contains an apostrophe
+        gap_id = _GAP_ID.search(response)
+        gap_name = _GAP_NAME.search(response)
+        gap_description = _GAP_DESCRIPTION.search(response)
+        if not (gap_id and gap_name and gap_description):
+            if response.strip():
+                print(fmt(f"Skipping unparseable gap: {response.strip()[:200]}", n="yellow"))
+            continue
         
         # Create a Gap object and add it to the list
-        gap = Gap(gap_id=gap_id, gap_name=gap_name, gap_description=gap_description)
+        gap = Gap(gap_id=int(gap_id.group(1)),
+                  gap_name=ast.literal_eval(gap_name.group(1)),
+                  gap_description=ast.literal_eval(gap_description.group(1)))
         gaps.append(gap)
     
     return gaps
 
+def _gap_text(gap: Gap) -> str:
+    return f"{gap.gap_name}: {gap.gap_description}"
+
+def _hypothesis_text(hypothesis) -> str:
+    # The index-backed path may hand back plain text instead of a `Hypothesis`
+    if isinstance(hypothesis, Hypothesis):
+        return f"{hypothesis.hypothesis_name}: {hypothesis.hypothesis_description}"
+    return str(hypothesis)
+
+def _split_to_budget(text: str, max_tokens: int) -> List[str]:
+    """Splits `text` into windows of at most `max_tokens` (estimated tokens),
+    on paragraph boundaries where possible."""
+    max_chars = max_tokens * 4
+    windows, current = [], ""
+    for paragraph in text.split("\n\n"):
+        # Paragraphs that are too long on their own are cut hard
+        while len(paragraph) > max_chars:
+            if current:
+                windows.append(current)
+                current = ""
+            windows.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            windows.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        windows.append(current)
+    return windows
+
+def _batch_to_budget(items: list, costs: List[int], max_tokens: int) -> List[list]:
+    # Greedily packs items into batches whose costs sum to at most `max_tokens`
+    batches, current, used = [], [], 0
+    for item, cost in zip(items, costs):
+        if current and used + cost > max_tokens:
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
 class GapFinder:
     def __init__(
             self, k: int,
             init_contexts: List[Context],
-            chunk_size=100,
+            chunk_size: int = DFT_CHUNK_SIZE,
+            chunk_overlap: int = DFT_CHUNK_OVERLAP,
+            chunker: str = "paper",
+            drop_back_matter: bool = True,
             hypothesis_use_index=False,
+            persist_dir: Optional[str] = None,
+            collection_name: str = "research",
+            embedding_cache_path: Optional[str] = DFT_EMBEDDING_CACHE_PATH,
+            embed_batch_size: int = DFT_EMBED_BATCH_SIZE,
+            max_concurrency: int = 1,
+            requests_per_minute: Optional[int] = None,
+            gap_mode: str = "structured",
+            max_tokens_per_call: int = DFT_MAX_TOKENS_PER_CALL,
+            dedup_threshold: Optional[float] = DFT_SIMILARITY_THRESHOLD,
+            llm_model: str = DFT_LLM_MODEL,
             **kwargs
             ):
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        from llama_index.llms.openai import OpenAI
+        from Modules.Dedup import SemanticDeduplicator
+        from Modules.EmbeddingCache import CachedEmbedding
+
+        # Token/latency accounting for every llama_index LLM call
+        instrument_llama_index()
+
         # The gaps that have been found by some external system
         self.gaps = None
-        self.gap_finding_agent = OpenAI(model="gpt-4o-mini")
+        # Shares warm connections with every other LLM client in the process
+        self.gap_finding_agent = OpenAI(model=llm_model,
+                                        http_client=shared_http_client(),
+                                        async_http_client=shared_http_client(is_async=True))
+        # "paper" chunks along sections and paragraphs (SEE `Modules/PaperChunker.py`),
+        # "token" into fixed token windows. NOTE: Papers already in a persisted
+        # index keep their chunks until their text changes.
+        assert chunker in ("paper", "token"), f"chunker must be 'paper' or 'token', not {chunker!r}."
+        assert chunk_overlap < chunk_size, "chunk_overlap must be smaller than chunk_size."
+        self.chunker = chunker
         self.chunk_size = chunk_size
-        self.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+        self.chunk_overlap = chunk_overlap
+        # Leave references and acknowledgements out of the index ("paper" only)
+        self.drop_back_matter = drop_back_matter
+        # Batched, and cached on disk by (model, chunk hash) so nothing is embedded twice
+        self.embed_model = CachedEmbedding(
+            HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5"),
+            cache_path=embedding_cache_path,
+            embed_batch_size=embed_batch_size,
+        )
+        # Streaming stages may ingest from several threads; the pipeline isn't thread-safe
+        self._ingest_lock = threading.Lock()
+        # Where the Chroma index and ingestion docstore live; None keeps them in memory
+        self.persist_dir = persist_dir
+        # Persisted instances with different names get separate indices; same
+        # name shares one. In-memory instances always get their own.
+        self.collection_name = collection_name
         self.__init_vector_store(init_contexts)
         self.k = k  # Correctly assign the value of k
         self.hypothesis_use_index = hypothesis_use_index
+        self._stream_gap_ids = count(1)
+        # Max LLM requests in flight at once; 1 runs them one after another
+        assert isinstance(max_concurrency, int) and max_concurrency > 0, "max_concurrency must be a positive integer."
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute=requests_per_minute)
+        # "structured": one validated `GapList` via function calling.
+        # "accumulate": one `Gap` per chunk, parsed back out of the text.
+        # "map_reduce": gaps per paper in parallel (`max_concurrency` at a
+        #   time), then merged and deduplicated by a reduce step.
+        assert gap_mode in ("structured", "accumulate", "map_reduce"), f"Unsupported gap_mode '{gap_mode}'."
+        self.gap_mode = gap_mode
+        # Cap on prompt tokens per map/reduce call; longer papers are split
+        assert isinstance(max_tokens_per_call, int) and max_tokens_per_call > 0, "max_tokens_per_call must be a positive integer."
+        self.max_tokens_per_call = max_tokens_per_call
+        # Near-duplicate gaps/hypotheses (within a call and across `core` calls)
+        # are forwarded once, so each costs one downstream LLM call; None disables
+        self.dedup_threshold = dedup_threshold
+        self.gap_dedup = self.hypothesis_dedup = None
+        if dedup_threshold is not None:
+            self.gap_dedup = SemanticDeduplicator(self.embed_model, threshold=dedup_threshold)
+            self.hypothesis_dedup = SemanticDeduplicator(self.embed_model, threshold=dedup_threshold)
     
     ###########################
     ####### HOUSEKEEPING ######
@@ -70,23 +261,69 @@ class GapFinder:
         Returns:
             Type[None]: _description_
         """
-        # TODO: Initialize the vector store / ChromaDB stuff
-        self.vector_store = ChromaVectorStore(
-            chroma_collection=chromadb.Client().create_collection("research")
-        )
+        import chromadb
+        from llama_index.core import VectorStoreIndex
+        from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
+        from llama_index.core.node_parser import TokenTextSplitter
+        from Modules.PaperChunker import DFT_DROP_SECTIONS, PaperChunker
+        from llama_index.core.storage.docstore import SimpleDocumentStore
+        from llama_index.vector_stores.chroma import ChromaVectorStore
+
+        start = time.perf_counter()
+        if self.persist_dir is not None:
+            chroma_client = chromadb.PersistentClient(path=self.persist_dir)
+            collection_name = self.collection_name
+        else:
+            # Every EphemeralClient in the process sees the same collections, but
+            # each in-memory instance starts with an empty docstore; a shared
+            # collection would get every paper's chunks again on top
+            chroma_client = chromadb.EphemeralClient()
+            collection_name = f"{self.collection_name}-{uuid.uuid4().hex}"
+        # get-or-create so a restarted worker (or a second GapFinder) reuses the collection
+        chroma_collection = chroma_client.get_or_create_collection(collection_name)
+
+        # The docstore remembers the hash of every document already in the
+        # vector store, so re-ingesting an unchanged paper is a no-op. It is
+        # persisted next to the collection so that also holds across restarts.
+        docstore = SimpleDocumentStore()
+        if self._docstore_path is not None and os.path.exists(self._docstore_path):
+            if chroma_collection.count() > 0:
+                docstore = SimpleDocumentStore.from_persist_path(self._docstore_path)
+            else:
+                # The vectors are gone (e.g. wiped by hand); re-embed everything
+                print(f"Ignoring {self._docstore_path}: collection '{collection_name}' is empty.")
+        elif chroma_collection.count() > 0:
+            # Vectors without the docstore that tracks them (e.g. it was deleted
+            # by hand) can't be upserted, only duplicated; start the collection
+            # over. The embedding cache makes re-ingesting cheap.
+            print(f"Resetting collection '{collection_name}': no docstore at {self._docstore_path}.")
+            chroma_client.delete_collection(collection_name)
+            chroma_collection = chroma_client.create_collection(collection_name)
+        self.vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+        self._chroma_collection = chroma_collection
         #self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
-        init_docs = [Document(text=ctx.paper_context, metadata={"paper_id": ctx.paper_id}) for ctx in init_contexts]
-        
+        print(f"Opened collection '{collection_name}' with {chroma_collection.count()} chunks "
+              f"and {len(docstore.docs)} documents in {time.perf_counter() - start:.2f}s.")
+        # paper_id -> docstore ids of its documents; built on first use, reset on ingestion
+        self._paper_docs: Optional[Dict[int, List[str]]] = None
+
+        if self.chunker == "paper":
+            self.splitter = PaperChunker(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+                                         drop_sections=DFT_DROP_SECTIONS if self.drop_back_matter else ())
+        else:
+            self.splitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
         self.pipeline = IngestionPipeline(
             transformations=[
-                #SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=0),
-                TokenTextSplitter(chunk_size=1024, chunk_overlap=128),
+                self.splitter,
                 self.embed_model,
             ],
             vector_store=self.vector_store,
+            docstore=docstore,
+            docstore_strategy=DocstoreStrategy.UPSERTS,
         )
 
-        self.pipeline.run(documents=init_docs)
+        self._adds_papers_to_store(init_contexts)
         self.index = VectorStoreIndex.from_vector_store(self.vector_store, embed_model=self.embed_model)
     
     ###########################
@@ -94,7 +331,7 @@ class GapFinder:
     ###########################
     
     @critic.overwatch
-    def find_gaps(self, **kwargs) -> List[Gap]:
+    def find_gaps(self, paper_ids: Optional[List[int]] = None, **kwargs) -> List[Gap]:
         """Given a research body, this function finds the gaps in the research and structures them in a particular way.
         Each gap identified is only meant to identify crucial flaws and/or missing componeents (gaps) in the research. Each
         gap is NOT meant to offer solutions or suggestions inline. A separate function will be used to generate hypotheses
@@ -103,22 +340,46 @@ class GapFinder:
         Returns:
             List[Gap]: The gaps that were found organized in a list.
         """
-        
-        # TODO: ABSTRACT THIS AWAY
-        gap_finder_prompt = """
-        Please identify potential research gaps, opportunities, or areas for further investigation based on the given papers. Please include citations for each claimed gap. Be as specific as possible.
-        """
+        return self._find_gaps(paper_ids=paper_ids, **kwargs)
+
+    # `find_gaps`/`get_hypotheses` without the critic, for per-item streaming
+    # stages; `core.run` critiques their collected outputs once per loop
+
+    def _find_gaps(self, paper_ids: Optional[List[int]] = None, **kwargs) -> List[Gap]:
+        gap_finder_prompt = GAP_FINDER_PROMPT
+        if self.gap_mode == "map_reduce":
+            return self._map_reduce_gaps(gap_finder_prompt, paper_ids=paper_ids)
+
+        # Optionally restrict retrieval to a subset of the papers
+        filters = None
+        if paper_ids is not None:
+            from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+            filters = MetadataFilters(filters=[MetadataFilter(key="paper_id", value=list(paper_ids), operator=FilterOperator.IN)])
+
+        if self.gap_mode == "accumulate":
+            query_engine = self.index.as_query_engine(
+                output_cls=Gap,
+                response_mode="accumulate",
+                llm=self.gap_finding_agent,
+                filters=filters
+            )
+            response = query_engine.query(gap_finder_prompt).response
+            return response_to_gaps(response)
+
+        # The LLM fills a `GapList` schema through function calling and
+        # pydantic validates it, so there's no text to parse back out
         query_engine = self.index.as_query_engine(
-            output_cls=Gap,
-            response_mode="accumulate",
-            llm=self.gap_finding_agent
+            output_cls=GapList,
+            response_mode="tree_summarize",
+            llm=self.gap_finding_agent,
+            filters=filters
         )
-        response = query_engine.query(gap_finder_prompt).response
-
-        return response_to_gaps(response)
+        gap_list: GapList = query_engine.query(gap_finder_prompt).response
+        # Ids are only meaningful within this list; make sure they're unique
+        return [gap.model_copy(update={"gap_id": i}) for i, gap in enumerate(gap_list.gaps, start=1)]
     
     @critic.overwatch
-    def get_hypotheses(self, gaps: List[Gap]) -> List[Hypothesis]:
+    def get_hypotheses(self, gaps: List[Gap]) -> List[Optional[Hypothesis]]:
         """This function generates hypotheses based on the gaps that were found.
         It structures the hypotheses in a particular way. The output of this function
         will be used by the next function to design experiments. As a result, each hypothesis should be
@@ -128,43 +389,46 @@ class GapFinder:
             gaps (List[Gap]): These are the gaps that were found in the research by a previous function.
 
         Returns:
-            List[Hypothesis]: This is a list of hypotheses that were generated based on the gaps.
+            List[Optional[Hypothesis]]: This is a list of hypotheses that were generated based on the gaps,
+                one per gap and in the same order. None where generation failed for that gap.
         """
-        
-        # TODO: ABSTRACT THIS AWAY
-        prompt_tmpl = PromptTemplate(
-            """
-            Can you please help me generate a research hypothesis based on the following research gap that we've identified?
+        return self._get_hypotheses(gaps)
 
-            A hypothesis may include the following:
-             - A proposed explanation for a phenomenon
-             - A proposed novel approach for solving a problem
-             - A novel algorithm, method, or combination of methods
-             - A novel problem formulation
+    def _get_hypotheses(self, gaps: List[Gap]) -> List[Optional[Hypothesis]]:
+        from llama_index.core.prompts import PromptTemplate
 
-            Please be as specific as possible. Here is the research gap:
+        prompt_tmpl = PromptTemplate(HYPOTHESIS_PROMPT)
 
-            {gap_description}
-            """
-        )
+        llm = self.gap_finding_agent.as_structured_llm(Hypothesis)
+        # Built once and shared by every gap rather than once per gap
+        query_engine = self.index.as_query_engine(llm=llm) if self.hypothesis_use_index else None
 
-        def _get(gap: Type[Gap]) -> Hypothesis: # type: ignore
-            hyp = self.gap_finding_agent.as_structured_llm(Hypothesis).complete(
+        async def _get(gap: Type[Gap]) -> Hypothesis: # type: ignore
+            hyp = (await llm.acomplete(
                 prompt_tmpl.format(gap_description=gap.gap_description)
-            ).raw
+            )).raw
             return hyp
         
-        def _get_with_index(gap: Type[Gap]) -> Hypothesis: # type: ignore
-            llm = self.gap_finding_agent.as_structured_llm(Hypothesis)
-            query_engine = self.index.as_query_engine(llm=llm)
-            r = query_engine.query(
+        async def _get_with_index(gap: Type[Gap]) -> Hypothesis: # type: ignore
+            r = await query_engine.aquery(
                 prompt_tmpl.format(gap_description=gap.gap_description)
             )
             return r.response
         
         hyp_fn = _get_with_index if self.hypothesis_use_index else _get
         
-        return [hyp_fn(gap) for gap in gaps]
+        results = run_sync(gather_bounded([lambda gap=gap: hyp_fn(gap) for gap in gaps],
+                                          max_concurrency=self.max_concurrency,
+                                          rate_limiter=self.rate_limiter))
+        
+        # A failed gap is reported and left as None, so hypotheses stay aligned with gaps
+        hypotheses = []
+        for gap, result in zip(gaps, results):
+            if isinstance(result, BaseException):
+                print(fmt(f"Hypothesis generation failed for gap {gap.gap_id}: {result}", n="red"))
+                result = None
+            hypotheses.append(result)
+        return hypotheses
     
     def convert_papers_to_flowcharts(self, contexts: List[Context], **kwargs) -> List[ExperimentalDesign]:
         """Given the contexts, it converts the papers to flowcharts.
@@ -182,31 +446,156 @@ class GapFinder:
     ######### HELPERS #########
     ###########################
     
-    def _get_top_k_papers(self, query: str, top_k: int, **kwargs) -> List[Context]:
+    def _map_reduce_gaps(self, gap_finder_prompt: str, paper_ids: Optional[List[int]] = None) -> List[Gap]:
+        """Finds gaps paper by paper, then merges them.
+
+        Map: each paper (split into windows of at most `max_tokens_per_call`
+        prompt tokens) gets its own structured gap-extraction call, with up
+        to `max_concurrency` in flight. Reduce: the per-paper gaps are merged
+        and deduplicated, in batches that also respect the cap, until a
+        single list remains.
+        """
+        from llama_index.core.prompts import PromptTemplate
+
+        map_tmpl = PromptTemplate(MAP_PROMPT)
+        reduce_tmpl = PromptTemplate(REDUCE_PROMPT)
+        llm = self.gap_finding_agent.as_structured_llm(GapList)
+
+        async def _extract(prompt: str) -> GapList:
+            return (await llm.acomplete(prompt)).raw
+
+        # Map
+        text_budget = self.max_tokens_per_call - estimate_tokens(map_tmpl.format(instructions=gap_finder_prompt, paper_id="", paper_text=""))
+        assert text_budget > 0, "max_tokens_per_call is too small to fit the gap-finding prompt."
+        map_prompts = [
+            map_tmpl.format(instructions=gap_finder_prompt, paper_id=paper_id, paper_text=window)
+            for paper_id, text in self._paper_texts(paper_ids).items()
+            for window in _split_to_budget(text, text_budget)
+        ]
+        gaps = [gap for result in self._run_gap_calls(_extract, map_prompts, stage="map") if result is not None
+                for gap in result]
+        print(f"Map: {len(gaps)} gaps from {len(map_prompts)} calls.")
+
+        # Reduce, a level at a time, until everything fits in one call
+        gap_budget = self.max_tokens_per_call - estimate_tokens(reduce_tmpl.format(gap_list=""))
+        assert gap_budget > 0, "max_tokens_per_call is too small to fit the reduce prompt."
+        while len(map_prompts) > 1 and gaps:
+            lines = [f"- {gap.gap_name}: {gap.gap_description}" for gap in gaps]
+            batches = _batch_to_budget(list(range(len(gaps))), [estimate_tokens(line) for line in lines], gap_budget)
+            results = self._run_gap_calls(_extract, [reduce_tmpl.format(gap_list="\n".join(lines[i] for i in batch))
+                                                     for batch in batches], stage="reduce")
+            # A failed batch keeps its gaps unmerged rather than losing them
+            reduced = [gap for batch, result in zip(batches, results)
+                       for gap in (result if result is not None else [gaps[i] for i in batch])]
+            print(f"Reduce: {len(gaps)} gaps -> {len(reduced)} in {len(batches)} calls.")
+            done = len(batches) == 1 or len(reduced) >= len(gaps)
+            gaps = reduced
+            if done:
+                # Everything was merged in one call, or the rest are all distinct
+                break
+
+        return [gap.model_copy(update={"gap_id": i}) for i, gap in enumerate(gaps, start=1)]
+
+    def _run_gap_calls(self, extract, prompts: List[str], stage: str) -> List[Optional[List[Gap]]]:
+        # Runs the structured calls concurrently. A failed call is reported
+        # and yields None, so one bad paper doesn't sink the whole stage.
+        results = run_sync(gather_bounded([lambda prompt=prompt: extract(prompt) for prompt in prompts],
+                                          max_concurrency=self.max_concurrency,
+                                          rate_limiter=self.rate_limiter,
+                                          token_costs=[estimate_tokens(prompt) for prompt in prompts]))
+        gap_lists = []
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                print(fmt(f"Gap {stage} call {i} failed: {type(result).__name__} {result}", n="red"))
+                gap_lists.append(None)
+                continue
+            gap_lists.append(result.gaps)
+        return gap_lists
+
+    def _paper_texts(self, paper_ids: Optional[List[int]] = None) -> Dict[int, str]:
+        # Each paper's full text (all papers if `paper_ids` is None)
+        paper_docs = self._paper_doc_ids()
+        if paper_ids is None:
+            paper_ids = list(paper_docs)
+        return {paper_id: self._paper_text(paper_id) for paper_id in paper_ids if paper_id in paper_docs}
+
+    def _paper_text(self, paper_id: int) -> str:
+        # Rebuilt from the paper's documents in the docstore (one per paper,
+        # or one per page, joined in page order)
+        docstore = self.pipeline.docstore
+        return "\n\n".join(docstore.get_document(doc_id).text for doc_id in self._paper_doc_ids()[paper_id])
+
+    def _paper_doc_ids(self) -> Dict[int, List[str]]:
+        if self._paper_docs is None:
+            pages = defaultdict(list)
+            for doc_id, doc in self.pipeline.docstore.docs.items():
+                paper_id = doc.metadata.get("paper_id")
+                if paper_id is not None:
+                    pages[paper_id].append((doc.metadata.get("page", 0), doc_id))
+            self._paper_docs = {}
+            for paper_id, paper_pages in sorted(pages.items()):
+                paper_pages.sort()
+                # A paper ingested both whole (page 0) and page by page is read from the whole document
+                if paper_pages[0][0] == 0:
+                    paper_pages = paper_pages[:1]
+                self._paper_docs[paper_id] = [doc_id for _, doc_id in paper_pages]
+        return self._paper_docs
+    
+    def _get_top_k_papers(self, query: str, top_k: Optional[int] = None, pooling: str = "max",
+                          chunks_per_paper: int = DFT_CHUNKS_PER_PAPER, **kwargs) -> List[Context]:
         """This gets the top k papers from the accumulated research. Searches
         over the vector store for the most relevant papers.
 
+        Retrieves the `top_k * chunks_per_paper` nearest chunks straight from
+        Chroma, pools their scores by `paper_id` and ranks the papers. Query
+        embeddings are cached, so calling this once per hypothesis is cheap.
+
+        Args:
+            query (str): A query, e.g. a gap or hypothesis description.
+            top_k (Optional[int]): Papers to return. Defaults to `self.k`.
+            pooling (str): "max" ranks a paper by its best chunk, "mean" by
+                the average of its retrieved chunks. Defaults to "max".
+            chunks_per_paper (int): Chunks retrieved per requested paper.
+
         Returns:
-            List[Context]: _description_
+            List[Context]: The most relevant papers, best first.
         """
+        from llama_index.core.vector_stores import VectorStoreQuery
+
+        top_k = self.k if top_k is None else top_k
+        assert pooling in ("max", "mean"), f"Unsupported pooling '{pooling}'."
+        n_chunks = self._chroma_collection.count()
+        if top_k <= 0 or n_chunks == 0:
+            return []
         
-        # TODO: Make this it's own file later
-        query = """
-        Given the accumulated research and the following hypothesis, find the
-        most relevant papers.
+        result = self.vector_store.query(VectorStoreQuery(
+            query_embedding=self.embed_model.get_query_embedding(query),
+            similarity_top_k=min(n_chunks, top_k * chunks_per_paper),
+        ))
         
-        {{research}}
-        {{hypothesis}}
-        """
+        # Pool chunk scores back up to the paper they came from
+        scores = defaultdict(list)
+        for node, score in zip(result.nodes, result.similarities):
+            paper_id = node.metadata.get("paper_id")
+            if paper_id is not None:
+                scores[paper_id].append(score)
+        pool = max if pooling == "max" else (lambda paper_scores: sum(paper_scores) / len(paper_scores))
+        ranked = sorted(scores, key=lambda paper_id: pool(scores[paper_id]), reverse=True)
         
-        # Get the top k papers
-        return [""]
+        paper_docs = self._paper_doc_ids()
+        return [Context(paper_id=paper_id, paper_context=self._paper_text(paper_id))
+                for paper_id in ranked if paper_id in paper_docs][:top_k]
     
-    def _adds_papers_to_store(self, papers: List[Context], **kwargs) -> Type[None]:
-        """Adds the papers to the vector store.
+    def _adds_papers_to_store(self, papers: List[Context], delete_missing: bool = False, **kwargs) -> Type[None]:
+        """Adds the papers to the vector store. Only papers that are new or whose
+        text changed are chunked and embedded; changed papers replace their old
+        chunks.
 
         Args:
             papers (List[Context]): _description_
+            delete_missing (bool, optional): Treat `papers` as the full corpus and
+                remove every stored paper that isn't in it. Pages added with
+                `add_page_stream` are kept. Defaults to False.
         """
         # if papers is empty, do nothing
         if not papers:
@@ -214,23 +603,212 @@ class GapFinder:
         
         # Add the papers to the vector store
         # each context contains a paper_id and paper_context
-        docs = [Document(text=ctx.paper_context, metadata={"paper_id": ctx.paper_id}) for ctx in papers]
-        self.pipeline.run(documents=docs)
+        docs = [_context_to_document(ctx) for ctx in papers]
+        self._ingest(docs, delete_missing=delete_missing)
+
+    def add_page_stream(self, pages: Iterable[Page], batch_size: int = 32,
+                        ingestion_report: Optional[List[IngestionRecord]] = None, **kwargs) -> int:
+        """Chunks, embeds and stores pages as they arrive (e.g. from
+        `ResearchAccumulator.stream_pages`), `batch_size` pages at a time, so the
+        first embeddings are written before the last page has been parsed and
+        only one batch of text is held in memory.
+
+        Args:
+            pages (Iterable[Page]): Page-level chunks, possibly a generator.
+            batch_size (int, optional): Pages per ingestion run. Defaults to 32.
+            ingestion_report (List[IngestionRecord], optional): The report the
+                stream files its records in (`ResearchAccumulator.ingestion_report`).
+                Papers that fail part-way are rolled back rather than left in
+                the store in part. Defaults to None.
+
+        Returns:
+            int: The number of pages ingested.
+        """
+        assert isinstance(batch_size, int) and batch_size > 0, "batch_size must be a positive integer."
+
+        def _failed():
+            return {record.paper_id for record in ingestion_report or ()
+                    if record.error is not None and record.paper_id is not None}
+
+        pages = iter(pages)
+        n_pages = defaultdict(int)
+        while True:
+            batch = list(islice(pages, batch_size))
+            if not batch:
+                break
+            # Pages of a paper that already failed aren't worth embedding
+            failed = _failed()
+            batch = [page for page in batch if page.paper_id not in failed]
+            if batch:
+                self._ingest([_page_to_document(page) for page in batch])
+            for page in batch:
+                n_pages[page.paper_id] += 1
+
+        # The ones ingested before their paper failed
+        failed = _failed() & n_pages.keys()
+        if failed:
+            self._drop_pages(failed)
+        return sum(n for paper_id, n in n_pages.items() if paper_id not in failed)
+
+    def _drop_pages(self, paper_ids: Iterable[int]) -> Type[None]:
+        # Removes every page `add_page_stream` stored for `paper_ids`
+        paper_ids = {str(paper_id) for paper_id in paper_ids}
+        with self._ingest_lock:
+            stored_ids = set(self.pipeline.docstore.get_all_document_hashes().values())
+            matches = [_PAGE_DOC_ID.fullmatch(doc_id) for doc_id in stored_ids]
+            doc_ids = {match.group(0) for match in matches if match and match.group(1) in paper_ids}
+            print(f"Ingestion: {len(doc_ids)} pages of {len(paper_ids)} failed papers rolled back.")
+            self._delete_documents(doc_ids)
+
+    def _ingest(self, docs: List["Document"], delete_missing: bool = False) -> Type[None]:
+        with self._ingest_lock:
+            self.__ingest(docs, delete_missing)
+
+    def __ingest(self, docs: List["Document"], delete_missing: bool) -> Type[None]:
+        # Diff against the docstore up front so we can skip the pipeline
+        # entirely when nothing changed, and report what it's about to do.
+        docstore = self.pipeline.docstore
+        stored_ids = set(docstore.get_all_document_hashes().values())
+        incoming_ids = {doc.id_ for doc in docs}
+        new = [doc for doc in docs if doc.id_ not in stored_ids]
+        changed = [doc for doc in docs if doc.id_ in stored_ids and docstore.get_document_hash(doc.id_) != doc.hash]
+        # Only whole papers count as missing; pages from `add_page_stream` are
+        # never part of `docs` here and must survive
+        deleted = {doc_id for doc_id in stored_ids - incoming_ids if _PAPER_DOC_ID.fullmatch(doc_id)} if delete_missing else set()
+        print(f"Ingestion: {len(new)} new, {len(changed)} changed, "
+              f"{len(docs) - len(new) - len(changed)} unchanged, {len(deleted)} deleted.")
+        if not (new or changed or deleted):
+            return
+
+        if new or changed:
+            self.pipeline.run(documents=docs)
+            embed_stats = self.embed_model.stats()
+            print(f"Embedding: {embed_stats['chunks_embedded']} chunks at {embed_stats['chunks_per_sec']:.1f} chunks/sec "
+                  f"({embed_stats['text_hit_rate']:.0%} served from cache).")
+            if self.chunker == "paper":
+                chunk_stats = self.splitter.stats()
+                print(f"Chunking: {chunk_stats['chunks']} chunks from {chunk_stats['documents']} documents "
+                      f"({chunk_stats['chunks_per_document']:.1f} per document, max {chunk_stats['max_chunks_per_document']}), "
+                      f"{chunk_stats['sections_dropped']} back-matter sections dropped.")
+        self._delete_documents(deleted)
+
+    def _delete_documents(self, doc_ids: Iterable[str]) -> Type[None]:
+        # Callers hold `_ingest_lock`
+        docstore = self.pipeline.docstore
+        for doc_id in doc_ids:
+            # What DocstoreStrategy.UPSERTS_AND_DELETE does, scoped to `doc_ids`
+            self.vector_store.delete(doc_id)
+            docstore.delete_document(doc_id)
+        self._paper_docs = None
+        if self._docstore_path is not None:
+            docstore.persist(persist_path=self._docstore_path)
+
+    @property
+    def _docstore_path(self) -> Optional[str]:
+        if self.persist_dir is None:
+            return None
+        return os.path.join(self.persist_dir, f"{self.collection_name}_docstore.json")
 
     
     ###########################
     ########### CORE ##########
     ###########################
     
-    def core(self, paper_contexts: List[Context]) -> List[Hypothesis]:
-        self._adds_papers_to_store(paper_contexts)
-        # top_k_papers: List[Context] = self._get_top_k_papers(query="Some query", top_k=self.k)
+    def core(self, paper_contexts: List[Context], focus: Optional[str] = None) -> List[Hypothesis]:
+        self.ingest(paper_contexts)
+        gaps: List[Gap] = self.new_gaps(focus=focus)
+        return self.new_hypotheses(gaps)
+
+    # `core` in steps, so `core.run` can checkpoint each one separately
+
+    def ingest(self, paper_contexts: List[Context]) -> None:
+        # `paper_contexts` is the full accumulated corpus, so anything no longer
+        # in it is dropped; unchanged papers cost a hash lookup, not an embedding.
+        self._adds_papers_to_store(paper_contexts, delete_missing=True)
+
+    def new_gaps(self, focus: Optional[str] = None) -> List[Gap]:
+        # With a `focus` (e.g. a research question), only its top `k` papers are mined for gaps
+        paper_ids = None
+        if focus is not None:
+            top_k_papers: List[Context] = self._get_top_k_papers(query=focus, top_k=self.k)
+            paper_ids = [ctx.paper_id for ctx in top_k_papers]
+            print(f"Focusing on papers {paper_ids}.")
         # flowcharts: List[ExperimentalDesign] = self.convert_papers_to_flowcharts(top_k_papers)
         
         # Initially, each of these is a single LLM query
-        gaps: List[Gap] = self.find_gaps() # Use vector store
-        hypotheses: List[Hypothesis] = self.get_hypotheses(gaps) # Maybe use vector store
-        
+        gaps: List[Gap] = self.find_gaps(paper_ids=paper_ids) # Use vector store
+        if self.gap_dedup is not None:
+            n_gaps = len(gaps)
+            gaps = self.gap_dedup.dedup(gaps, key=_gap_text)
+            print(f"Dedup: {n_gaps} gaps -> {len(gaps)}.")
+        return gaps
+
+    def new_hypotheses(self, gaps: List[Gap]) -> List[Hypothesis]:
+        # Gaps whose generation failed have nothing to forward
+        hypotheses: List[Hypothesis] = [hyp for hyp in self.get_hypotheses(gaps) if hyp is not None] # Maybe use vector store
+        if self.hypothesis_dedup is not None:
+            n_hypotheses = len(hypotheses)
+            hypotheses = self.hypothesis_dedup.dedup(hypotheses, key=_hypothesis_text)
+            print(f"Dedup: {n_hypotheses} hypotheses -> {len(hypotheses)}.")
+        return hypotheses
+
+    def remember(self, gaps: Optional[List[Gap]] = None, hypotheses: Optional[List[Hypothesis]] = None) -> None:
+        """Counts checkpointed outputs as already forwarded, so a resumed run
+        deduplicates against them exactly as an uninterrupted one would."""
+        if gaps and self.gap_dedup is not None:
+            self.gap_dedup.remember_items(gaps, key=_gap_text)
+        if hypotheses and self.hypothesis_dedup is not None:
+            self.hypothesis_dedup.remember_items(hypotheses, key=_hypothesis_text)
+
+    def config(self) -> dict:
+        """Every setting that changes what gaps and hypotheses come out, for
+        checkpoint keys."""
+        return {
+            "llm_model": self.gap_finding_agent.model,
+            "api_base": self.gap_finding_agent.api_base,
+            "k": self.k,
+            "hypothesis_use_index": self.hypothesis_use_index,
+            "gap_mode": self.gap_mode,
+            "max_tokens_per_call": self.max_tokens_per_call,
+            "dedup_threshold": self.dedup_threshold,
+            "chunker": self.chunker,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "drop_back_matter": self.drop_back_matter,
+            "prompts": PROMPTS,
+        }
+
+    def corpus_fingerprint(self) -> List[str]:
+        """Content hashes of every document in the store; changes whenever a
+        paper is added, edited or dropped."""
+        return sorted(self.pipeline.docstore.get_all_document_hashes())
+
+    ###########################
+    ######## STREAMING ########
+    ###########################
+    
+    # Per-item counterparts of `core`, for `Modules/Pipeline.py` stages. They
+    # are safe to call from several threads at once, and aren't critiqued
+    # per item (SEE `Critic.review`).
+    
+    def paper_to_gaps(self, paper: Context) -> List[Gap]:
+        """Ingests one paper and returns the gaps found in it that aren't
+        near-duplicates of gaps already forwarded."""
+        self._adds_papers_to_store([paper])
+        with telemetry.stage("find_gaps"):
+            gaps = self._find_gaps(paper_ids=[paper.paper_id])
+        if self.gap_dedup is not None:
+            gaps = self.gap_dedup.dedup(gaps, key=_gap_text)
+        # `find_gaps` numbers from 1 per call; keep ids unique across papers
+        return [gap.model_copy(update={"gap_id": next(self._stream_gap_ids)}) for gap in gaps]
+    
+    def gap_to_hypotheses(self, gap: Gap) -> List[Hypothesis]:
+        """Generates the hypotheses for one gap, minus near-duplicates of
+        hypotheses already forwarded."""
+        with telemetry.stage("get_hypotheses"):
+            hypotheses = [hyp for hyp in self._get_hypotheses([gap]) if hyp is not None]
+        if self.hypothesis_dedup is not None:
+            hypotheses = self.hypothesis_dedup.dedup(hypotheses, key=_hypothesis_text)
         return hypotheses
     
 
@@ -243,8 +821,11 @@ if __name__ == '__main__':
     ctxs = ra.accumulate(dir=pdf_path)
 
     # Run the gap finder
-    gap_finder = GapFinder(init_contexts=ctxs, k=3, hypothesis_use_index=True)
+    gap_finder = GapFinder(init_contexts=ctxs, k=3, hypothesis_use_index=True, persist_dir=DFT_PERSIST_DIR)
     hyp = gap_finder.core([])
 
     for h in hyp:
         print(h.hypothesis_description)
+
+    # Critiques may still be running in the background
+    critic.flush()
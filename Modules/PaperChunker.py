@@ -0,0 +1,187 @@
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.interface import TextSplitter
+from llama_index.core.utils import get_tokenizer
+
+from Modules.Defaults import DFT_CHUNK_OVERLAP, DFT_CHUNK_SIZE
+
+# Sections that say nothing about the research itself
+DFT_DROP_SECTIONS = ("references", "bibliography", "acknowledgements", "acknowledgments",
+                     "acknowledgement", "acknowledgment")
+
+# Section titles recognized even without a number in front
+_KNOWN_SECTIONS = {
+    "abstract", "introduction", "background", "related work", "preliminaries", "method", "methods",
+    "methodology", "approach", "experiments", "experimental setup", "evaluation", "results", "discussion",
+    "analysis", "limitations", "conclusion", "conclusions", "future work", "appendix", "supplementary material",
+    *DFT_DROP_SECTIONS,
+}
+# "3 Method", "2.1 Datasets", "A.2 Proofs", "IV. RESULTS": a number, then a
+# short capitalized title without digits or trailing punctuation
+_NUMBERED_HEADING = re.compile(r"^(?:\d{1,2}(?:\.\d{1,2})*\.?|[A-Z](?:\.\d{1,2})+\.?|[IVX]{1,5}\.)\s+([A-Z][^\d\n]{0,80}?)\s*$")
+_MAX_HEADING_WORDS = 8
+# Titles don't end mid-phrase or start like a sentence; wrapped lines often do
+_DANGLING_WORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "is", "of", "on", "or", "that",
+                   "the", "to", "we", "which", "with"}
+_SENTENCE_STARTS = {"we", "our", "this", "these", "it", "its", "they", "here"}
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def _section_title(line: str, standalone: bool = True) -> Optional[str]:
+    """The title if `line` looks like a section heading, else None.
+
+    `standalone` says whether `line` starts a block (the text's first line,
+    or one after a blank line or another heading). Numbered headings must; otherwise table rows and
+    line-numbered or wrapped sentences ("12 We propose a new") would pass.
+    """
+    line = line.strip()
+    if line.rstrip(":").lower() in _KNOWN_SECTIONS:
+        return line.rstrip(":")
+    if not standalone:
+        return None
+    match = _NUMBERED_HEADING.match(line)
+    if match is None:
+        return None
+    title = match.group(1)
+    words = title.split()
+    if (len(words) > _MAX_HEADING_WORDS or title[-1] in ".,;:"
+            or words[-1].lower() in _DANGLING_WORDS or words[0].lower() in _SENTENCE_STARTS):
+        return None
+    return title
+
+def split_sections(text: str) -> List[Tuple[Optional[str], str]]:
+    """Splits `text` at its section headings into `(heading, body)` pairs.
+    Text before the first heading has heading None."""
+    sections: List[Tuple[Optional[str], List[str]]] = [(None, [])]
+    standalone = True
+    for line in text.splitlines():
+        if _section_title(line, standalone) is not None:
+            sections.append((line.strip(), []))
+            # e.g. "3.1 Datasets" right under "3 Method"
+            standalone = True
+        else:
+            sections[-1][1].append(line)
+            standalone = not line.strip()
+    return [(heading, "\n".join(lines)) for heading, lines in sections if heading is not None or "".join(lines).strip()]
+
+class PaperChunker(TextSplitter):
+    """Chunks research papers along their structure.
+
+    - Chunks never cross a section heading, and are packed from whole
+      paragraphs up to `chunk_size` tokens; only paragraphs that are too big
+      on their own are split further, at sentence boundaries.
+    - Consecutive chunks of a section share up to `chunk_overlap` tokens of
+      trailing paragraphs.
+    - Each chunk starts with its section's heading, so retrieval sees where
+      it came from.
+    - Sections whose title is in `drop_sections` (by default references and
+      acknowledgements) are dropped until the next heading.
+
+    `stats()` reports chunks per document and how much was dropped, for
+    tuning `chunk_size` against embedding cost and retrieval recall.
+    """
+
+    chunk_size: int = Field(default=DFT_CHUNK_SIZE, description="Max tokens per chunk.", gt=0)
+    chunk_overlap: int = Field(default=DFT_CHUNK_OVERLAP, description="Max tokens shared by consecutive chunks.", ge=0)
+    drop_sections: Tuple[str, ...] = Field(default=DFT_DROP_SECTIONS, description="Section titles to leave out.")
+    include_headings: bool = Field(default=True, description="Start every chunk with its section heading.")
+
+    _tokenizer: Callable = PrivateAttr()
+    _sentence_splitters: Dict[int, SentenceSplitter] = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _stats: Dict[str, int] = PrivateAttr()
+
+    def __init__(self, chunk_size: int = DFT_CHUNK_SIZE,
+                 chunk_overlap: int = DFT_CHUNK_OVERLAP,
+                 drop_sections: Sequence[str] = DFT_DROP_SECTIONS,
+                 include_headings: bool = True,
+                 tokenizer: Optional[Callable] = None,
+                 **kwargs):
+        assert chunk_overlap < chunk_size, "chunk_overlap must be smaller than chunk_size."
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                         drop_sections=tuple(title.lower() for title in drop_sections),
+                         include_headings=include_headings, **kwargs)
+        self._tokenizer = tokenizer or get_tokenizer()
+        # Keyed on the token budget left after the heading
+        self._sentence_splitters = {}
+        self._lock = threading.Lock()
+        self._stats = {"documents": 0, "chunks": 0, "max_chunks_per_document": 0,
+                       "sections": 0, "sections_dropped": 0, "characters_dropped": 0}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PaperChunker"
+
+    def split_text(self, text: str) -> List[str]:
+        chunks, n_sections, n_dropped, chars_dropped = [], 0, 0, 0
+        for heading, body in split_sections(text):
+            n_sections += 1
+            if heading is not None and _section_title(heading).lower() in self.drop_sections:
+                n_dropped += 1
+                chars_dropped += len(body)
+                continue
+            chunks += self._pack(heading, body)
+
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["chunks"] += len(chunks)
+            self._stats["max_chunks_per_document"] = max(self._stats["max_chunks_per_document"], len(chunks))
+            self._stats["sections"] += n_sections
+            self._stats["sections_dropped"] += n_dropped
+            self._stats["characters_dropped"] += chars_dropped
+        return chunks
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["chunks_per_document"] = stats["chunks"] / stats["documents"] if stats["documents"] else 0.0
+        return stats
+
+    def _pack(self, heading: Optional[str], body: str) -> List[str]:
+        prefix = f"{heading}\n" if heading is not None and self.include_headings else ""
+        # Always leave room for some text next to a (long) heading
+        budget = max(self.chunk_size - self._tokens(prefix), self.chunk_overlap + 1)
+        paragraphs = [(p.strip(), self._tokens(p.strip())) for p in _PARAGRAPH_BREAK.split(body) if p.strip()]
+
+        chunks: List[str] = []
+        current: List[Tuple[str, int]] = []
+        for paragraph, n_tokens in paragraphs:
+            if n_tokens > budget:
+                # Too big on its own (e.g. PDF text without blank lines): split by sentence
+                if current:
+                    chunks.append(prefix + "\n\n".join(p for p, _ in current))
+                    current = []
+                chunks += [prefix + piece for piece in self._sentence_splitter(budget).split_text(paragraph)]
+                continue
+            if current and sum(n for _, n in current) + n_tokens > budget:
+                chunks.append(prefix + "\n\n".join(p for p, _ in current))
+                current = self._overlap(current)
+                if sum(n for _, n in current) + n_tokens > budget:
+                    current = []
+            current.append((paragraph, n_tokens))
+        if current:
+            chunks.append(prefix + "\n\n".join(p for p, _ in current))
+        return chunks
+
+    def _overlap(self, paragraphs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        # The trailing paragraphs that fit in `chunk_overlap` tokens
+        carried, n_carried = [], 0
+        for paragraph, n_tokens in reversed(paragraphs):
+            if n_carried + n_tokens > self.chunk_overlap:
+                break
+            carried.insert(0, (paragraph, n_tokens))
+            n_carried += n_tokens
+        return carried
+
+    def _sentence_splitter(self, budget: int) -> SentenceSplitter:
+        with self._lock:
+            if budget not in self._sentence_splitters:
+                self._sentence_splitters[budget] = SentenceSplitter(chunk_size=budget, chunk_overlap=self.chunk_overlap,
+                                                                    tokenizer=self._tokenizer)
+            return self._sentence_splitters[budget]
+
+    def _tokens(self, text: str) -> int:
+        return len(self._tokenizer(text)) if text else 0
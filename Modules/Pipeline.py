@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+from contextvars import copy_context
+from typing import Any, Callable, Iterable, Iterator, List
+
+from sray_ValidatedLLM.modules.utilities import fmt
+
+# Items buffered between two stages before the upstream stage blocks
+DFT_QUEUE_SIZE = 8
+
+# Marks the end of a stream; one is passed on per downstream worker
+_DONE = object()
+# How often blocked workers check whether the pipeline was shut down
+_POLL_SECONDS = 0.1
+
+class Stage:
+    """One step of a `StreamingPipeline`.
+
+    `fn` takes a single item and returns an iterable of output items (empty
+    to emit nothing, several to fan out). `workers` threads run it at once,
+    and at most `queue_size` outputs wait for the next stage before this one
+    blocks (backpressure).
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Iterable[Any]], workers: int = 1, queue_size: int = DFT_QUEUE_SIZE):
+        assert isinstance(workers, int) and workers > 0, "workers must be a positive integer."
+        assert isinstance(queue_size, int) and queue_size > 0, "queue_size must be a positive integer."
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats = {"received": 0, "emitted": 0, "errors": 0, "busy_seconds": 0.0}
+
+class StreamingPipeline:
+    """Runs stages concurrently, connected by bounded queues.
+
+    Every item flows to the next stage as soon as it is produced, instead of
+    each stage waiting for the previous one to finish everything. An item
+    whose stage raises is reported and dropped; the rest keep flowing.
+
+    Worker threads run in a copy of the caller's context, so context-local
+    state (e.g. the telemetry stage/loop) carries over.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = DFT_QUEUE_SIZE):
+        assert stages, "A pipeline needs at least one stage."
+        assert isinstance(queue_size, int) and queue_size > 0, "queue_size must be a positive integer."
+        self.stages = stages
+        # Source items buffered ahead of the first stage
+        self.queue_size = queue_size
+
+    def run(self, source: Iterable[Any]) -> Iterator[Any]:
+        """Feeds `source` through the stages and yields the last stage's
+        outputs as they arrive (not necessarily in source order)."""
+        stop = threading.Event()
+        # queues[i] feeds stages[i]; the last one feeds the caller
+        queues = [queue.Queue(maxsize=self.queue_size)] + [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        consumers = [stage.workers for stage in self.stages] + [1]
+        finished = [0] * len(self.stages)
+        lock = threading.Lock()
+
+        def _put(i: int, item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    queues[i].put(item, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _get(i: int) -> Any:
+            while not stop.is_set():
+                try:
+                    return queues[i].get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def _feed() -> None:
+            try:
+                for item in source:
+                    if not _put(0, item):
+                        return
+            except Exception as e:
+                print(fmt(f"Pipeline source failed: {type(e).__name__} {e}", n="red"))
+            for _ in range(consumers[0]):
+                _put(0, _DONE)
+
+        def _work(i: int) -> None:
+            stage = self.stages[i]
+            while True:
+                item = _get(i)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    outputs = list(stage.fn(item))
+                except Exception as e:
+                    outputs = []
+                    with lock:
+                        stage.stats["errors"] += 1
+                    print(fmt(f"Stage '{stage.name}' failed on an item: {type(e).__name__} {e}", n="red"))
+                with lock:
+                    stage.stats["received"] += 1
+                    stage.stats["emitted"] += len(outputs)
+                    stage.stats["busy_seconds"] += time.perf_counter() - start
+                for output in outputs:
+                    if not _put(i + 1, output):
+                        return
+            # The last worker of a stage to finish closes the next stage's input
+            with lock:
+                finished[i] += 1
+                last = finished[i] == stage.workers
+            if last:
+                for _ in range(consumers[i + 1]):
+                    _put(i + 1, _DONE)
+
+        threads = [threading.Thread(target=copy_context().run, args=(_feed,), name="pipeline-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=copy_context().run, args=(_work, i), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                        for n in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = _get(len(self.stages))
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            # Also reached when the caller stops iterating early
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self) -> str:
+        lines = []
+        for stage in self.stages:
+            stats = stage.stats
+            lines.append(f"Stage '{stage.name}' ({stage.workers} worker(s)): {stats['received']} in, "
+                         f"{stats['emitted']} out, {stats['errors']} failed, {stats['busy_seconds']:.2f}s busy.")
+        return "\n".join(lines)
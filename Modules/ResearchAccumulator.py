@@ -1,56 +1,254 @@
+import hashlib
 import os
-from typing import List
-import PyPDF2 # camelot instead?
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
-from Schemas.Accumulation import Context
+from Modules.ExtractionCache import DFT_CACHE_DIR, DFT_CACHE_MAX_BYTES, ExtractionCache
+from Schemas.Accumulation import Context, IngestionRecord, Page
+
+# (text, page_offsets, seconds, error) as returned by a single extraction job
+ExtractionResult = Tuple[Optional[str], Optional[List[int]], float, Optional[str]]
+
+def _iter_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    # Lazily extract the PDF one page at a time as (1-indexed page number, text)
+    import PyPDF2 # camelot instead?
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num in range(len(reader.pages)):
+            yield page_num + 1, reader.pages[page_num].extract_text()
+
+def _split_pages(text: str, page_offsets: List[int]) -> Iterator[Tuple[int, str]]:
+    # Inverse of `_extract_text`: recover the pages from the joined text
+    bounds = page_offsets[1:] + [len(text)]
+    for page_num, (start, end) in enumerate(zip(page_offsets, bounds), start=1):
+        yield page_num, text[start:end]
+
+def _extract_text(pdf_path: str) -> Tuple[str, List[int]]:
+    # Extract the text from the PDF, along with the offset each page starts at
+    pages, page_offsets, offset = [], [], 0
+    for _, page_text in _iter_pages(pdf_path):
+        pages.append(page_text)
+        page_offsets.append(offset)
+        offset += len(page_text)
+    return ''.join(pages), page_offsets
+
+def paper_id_for(pdf_path: str, corpus_dir: str) -> int:
+    """Stable id of the paper at `pdf_path`, hashed from its path relative to
+    `corpus_dir`.
+
+    Every accumulator and extraction path (batch or streamed) hands the same
+    file the same id, so re-ingesting it upserts its documents rather than
+    adding a second copy, and an edited paper keeps its id and just replaces
+    its chunks. Moving or re-cloning the corpus keeps the ids too.
+    """
+    relative_path = os.path.relpath(pdf_path, corpus_dir).replace(os.sep, "/")
+    digest = hashlib.sha256(relative_path.encode("utf-8")).hexdigest()
+    # 48 bits: fits Chroma's integer metadata and stays readable in prompts
+    return int(digest[:12], 16)
+
+def _timed_extract(pdf_path: str) -> ExtractionResult:
+    # Runs inside the worker processes, so it lives at module level (picklable)
+    # and never raises: one corrupt PDF shouldn't take down the whole batch.
+    start = time.perf_counter()
+    try:
+        (text, page_offsets), error = _extract_text(pdf_path), None
+    except Exception as e:
+        text, page_offsets, error = None, None, f"{type(e).__name__}: {e}"
+    return text, page_offsets, time.perf_counter() - start, error
 
 class ResearchAccumulator:
-    def __init__(self):
+    def __init__(self, num_workers: int = 1,
+                 cache_dir: Optional[str] = DFT_CACHE_DIR,
+                 cache_max_bytes: int = DFT_CACHE_MAX_BYTES):
         # The research that has been accumulated by some external system
         self.research = []
         self.accumulation_agent = None
+        # Number of processes used to parse PDFs; 1 parses in-process
+        assert isinstance(num_workers, int) and num_workers > 0, "num_workers must be a positive integer."
+        self.num_workers = num_workers
+        # Per-file timing and failures from the latest `accumulate_from_dir`/`stream_pages` call
+        self.ingestion_report: List[IngestionRecord] = []
+        # Content-addressed cache of extracted text; None disables caching
+        self.cache = ExtractionCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir is not None else None
+
+    def accumulate_from_dir(self, dir, num_workers: Optional[int] = None):
+        num_workers = self.num_workers if num_workers is None else num_workers
+        assert isinstance(num_workers, int) and num_workers > 0, "num_workers must be a positive integer."
+
+        # Read the PDFs from the directory. Sorted so the contexts come back in
+        # the same order regardless of filesystem ordering.
+        pdf_paths = [os.path.join(dir, f) for f in sorted(os.listdir(dir)) if f.endswith('.pdf')]
+
+        start = time.perf_counter()
+        results = self.__extract_with_cache(pdf_paths, num_workers)
+
+        self.ingestion_report = []
+        for pdf_path, (text, _, seconds, error), cached in results:
+            paper_id = None
+            if error is None:
+                # Initialize the Context objects for each PDF
+                context = Context(
+                    paper_id=paper_id_for(pdf_path, dir),
+                    paper_context=text
+                    )
+                # Add the Context objects to the research list
+                self.research.append(context)
+                paper_id = context.paper_id
+            else:
+                print(f"Failed to extract {pdf_path}: {error}")
+            self.ingestion_report.append(
+                IngestionRecord(pdf_path=pdf_path, paper_id=paper_id, seconds=seconds,
+                                cached=cached, error=error)
+            )
+
+        n_failed = sum(record.error is not None for record in self.ingestion_report)
+        n_cached = sum(record.cached for record in self.ingestion_report)
+        print(f"Extracted {len(pdf_paths) - n_failed}/{len(pdf_paths)} PDFs "
+              f"({n_cached} from cache) in {time.perf_counter() - start:.2f}s with {num_workers} worker(s).")
 
-    def accumulate_from_dir(self, dir):
-        # Read the PDFs from the directory
-        pdf_files = [f for f in os.listdir(dir) if f.endswith('.pdf')]
-        
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(dir, pdf_file)
-            
-            # Extract text from each PDF
-            text = self.__extract_text(pdf_path)
-            
-            # Initialize the Context objects for each PDF
-            context = Context(
-                paper_id=len(self.research) + 1, # TODO: Is there a better way?
-                paper_context=text
-                )
-            
-            # Add the Context objects to the research list
-            self.research.append(context)
-    
     def accumulate(self, dir=None, **kwargs) -> List[Context]:
         if dir is not None:
-            self.accumulate_from_dir(dir)
+            self.accumulate_from_dir(dir, num_workers=kwargs.get("num_workers"))
         return self.research
-    
-    def __extract_text(self, pdf_path: str) -> str:
-        # Extract the text from the PDF
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text += page.extract_text()
-        return text
-    
+
+    def stream_pages(self, dir) -> Iterator[Page]:
+        """Streams the PDFs in `dir` page by page instead of materializing whole
+        papers. Pages are yielded as soon as they're parsed, so downstream
+        chunking/embedding can start before the last page of a large volume is
+        read, and memory stays bounded by a single page. Cached papers are
+        served from the extraction cache; misses are parsed without being
+        cached (`accumulate` and `stream_papers` populate it). Streamed papers
+        are NOT added to `self.research`.
+
+        A paper that fails part-way gets a failed `IngestionRecord` carrying its
+        `paper_id`, but the pages before the failure have already been yielded;
+        consumers roll them back from `self.ingestion_report` (SEE
+        `GapFinder.add_page_stream`), which is reset as soon as this is called.
+
+        Args:
+            dir (str): Directory containing the PDFs.
+
+        Yields:
+            Page: The pages of every paper, in file name then `page_num` order.
+        """
+        pdf_paths = [os.path.join(dir, f) for f in sorted(os.listdir(dir)) if f.endswith('.pdf')]
+        self.ingestion_report = []
+        return self.__stream_pages(pdf_paths, dir, self.ingestion_report)
+
+    def __stream_pages(self, pdf_paths: List[str], dir, report: List[IngestionRecord]) -> Iterator[Page]:
+        for pdf_path in pdf_paths:
+            start = time.perf_counter()
+            try:
+                key = self.cache.key_for(pdf_path) if self.cache is not None else None
+            except Exception as e:
+                # Unreadable (e.g. permissions, or removed since listing); skip it like a corrupt PDF
+                error = f"{type(e).__name__}: {e}"
+                print(f"Failed to extract {pdf_path}: {error}")
+                report.append(IngestionRecord(pdf_path=pdf_path, seconds=time.perf_counter() - start, error=error))
+                continue
+            cached = self.cache.get(key) if key is not None else None
+            pages = _split_pages(*cached) if cached is not None else _iter_pages(pdf_path)
+
+            paper_id, error = paper_id_for(pdf_path, dir), None
+            try:
+                for page_num, page_text in pages:
+                    yield Page(paper_id=paper_id, page_num=page_num, page_text=page_text)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Failed to extract {pdf_path}: {error}")
+
+            report.append(
+                IngestionRecord(pdf_path=pdf_path, paper_id=paper_id,
+                                seconds=time.perf_counter() - start, cached=cached is not None, error=error)
+            )
+
+    def stream_papers(self, dir) -> Iterator[Context]:
+        """Like `stream_pages`, but yields each paper as a whole `Context` as
+        soon as it's extracted, so downstream stages can start on the first
+        paper while the rest are still being read. Papers go through the
+        extraction cache like `accumulate`, and papers that fail to extract are
+        skipped (with a failed `IngestionRecord`), never yielded in part.
+        Streamed papers are NOT added to `self.research`.
+
+        Args:
+            dir (str): Directory containing the PDFs.
+
+        Yields:
+            Context: One per paper, in file name order.
+        """
+        pdf_paths = [os.path.join(dir, f) for f in sorted(os.listdir(dir)) if f.endswith('.pdf')]
+
+        self.ingestion_report = []
+        for pdf_path in pdf_paths:
+            # One paper at a time, so memory stays bounded by a single paper
+            [(_, (text, _, seconds, error), cached)] = self.__extract_with_cache([pdf_path], num_workers=1)
+            if error is not None:
+                print(f"Failed to extract {pdf_path}: {error}")
+                self.ingestion_report.append(IngestionRecord(pdf_path=pdf_path, seconds=seconds, error=error))
+                continue
+            paper_id = paper_id_for(pdf_path, dir)
+            self.ingestion_report.append(
+                IngestionRecord(pdf_path=pdf_path, paper_id=paper_id, seconds=seconds, cached=cached)
+            )
+            yield Context(paper_id=paper_id, paper_context=text)
+
+    def __extract_with_cache(self, pdf_paths: List[str], num_workers: int) -> List[Tuple[str, ExtractionResult, bool]]:
+        # Serve what we can from the cache and only send misses to the workers.
+        # The cache is only ever written from this (parent) process.
+        if self.cache is None:
+            return [(p, r, False) for p, r in zip(pdf_paths, self.__extract_many(pdf_paths, num_workers))]
+
+        keys, key_errors = [], {}
+        for i, pdf_path in enumerate(pdf_paths):
+            try:
+                keys.append(self.cache.key_for(pdf_path))
+            except Exception as e:
+                # Unreadable files fail on their own instead of aborting the batch
+                keys.append(None)
+                key_errors[i] = f"{type(e).__name__}: {e}"
+        cached = [self.cache.get(key) if key is not None else None for key in keys]
+        misses = [i for i, entry in enumerate(cached) if entry is None and i not in key_errors]
+        extracted = dict(zip(misses, self.__extract_many([pdf_paths[i] for i in misses], num_workers)))
+
+        results = []
+        for i, pdf_path in enumerate(pdf_paths):
+            if i in key_errors:
+                results.append((pdf_path, (None, None, 0.0, key_errors[i]), False))
+                continue
+            if cached[i] is not None:
+                text, page_offsets = cached[i]
+                results.append((pdf_path, (text, page_offsets, 0.0, None), True))
+                continue
+            text, page_offsets, seconds, error = extracted[i]
+            if error is None:
+                self.cache.put(keys[i], text, page_offsets)
+            results.append((pdf_path, extracted[i], False))
+        return results
+
+    def __extract_many(self, pdf_paths: List[str], num_workers: int) -> List[ExtractionResult]:
+        # Results always come back in the same order as `pdf_paths`
+        if num_workers == 1 or len(pdf_paths) <= 1:
+            return [_timed_extract(pdf_path) for pdf_path in pdf_paths]
+
+        results = []
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(pdf_paths))) as executor:
+            futures = [executor.submit(_timed_extract, pdf_path) for pdf_path in pdf_paths]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # e.g. the worker itself died (BrokenProcessPool) while parsing
+                    results.append((None, None, 0.0, f"{type(e).__name__}: {e}"))
+        return results
+
     ###########################
     ########### CORE ##########
     ###########################
-    
+
     def core(self) -> List[Context]:
         return self.accumulate()
-    
+
 
 
 if __name__ == '__main__':
@@ -58,7 +256,23 @@ if __name__ == '__main__':
     ra = ResearchAccumulator()
     ctx = ra.accumulate(dir=pdf_path)
     assert len(ctx) == 3
-    assert ctx[0].paper_id == 1
-    assert ctx[1].paper_id == 2
+    assert [c.paper_id for c in ctx] == [paper_id_for(os.path.join(pdf_path, f), pdf_path)
+                                         for f in sorted(os.listdir(pdf_path)) if f.endswith('.pdf')]
+
+    # Parallel ingestion must assign the same ids as the sequential path
+    ra_parallel = ResearchAccumulator(num_workers=4, cache_dir=None)
+    ctx_parallel = ra_parallel.accumulate(dir=pdf_path)
+    assert [c.paper_id for c in ctx_parallel] == [c.paper_id for c in ctx]
+    assert [c.paper_context for c in ctx_parallel] == [c.paper_context for c in ctx]
+
+    for record in ra_parallel.ingestion_report:
+        print(f"{record.pdf_path}: {record.seconds:.2f}s {'(cached) ' if record.cached else ''}{record.error or ''}")
+    print(ra.cache.stats())
+
+    # Streaming extraction yields the same text, one page at a time
+    pages = list(ResearchAccumulator(cache_dir=None).stream_pages(pdf_path))
+    assert "".join(p.page_text for p in pages if p.paper_id == ctx[0].paper_id) == ctx[0].paper_context
+    papers = list(ResearchAccumulator(cache_dir=None).stream_papers(pdf_path))
+    assert [c.paper_context for c in papers] == [c.paper_context for c in ctx]
 
-    print(ctx[0].paper_context)
\ No newline at end of file
+    print(ctx[0].paper_context)
@@ -1,5 +1,21 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 class Context(BaseModel):
     paper_id: int
-    paper_context: str
\ No newline at end of file
+    paper_context: str
+
+class Page(BaseModel):
+    """A single page of a paper, as yielded by streaming extraction."""
+    paper_id: int
+    page_num: int  # 1-indexed
+    page_text: str
+
+class IngestionRecord(BaseModel):
+    """Timing and outcome for a single PDF processed by the ResearchAccumulator."""
+    pdf_path: str
+    paper_id: Optional[int] = None  # None if extraction failed
+    seconds: float
+    cached: bool = False
+    error: Optional[str] = None
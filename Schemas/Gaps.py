@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel
 
 from Schemas.Accumulation import Context
@@ -20,6 +22,10 @@ class Gap(BaseModel):
     gap_name: str
     gap_description: str
 
+class GapList(BaseModel):
+    """Data model for every research gap found in the given papers."""
+    gaps: List[Gap]
+
 class Hypothesis(BaseModel):
     """Data model for a research hypothesis."""
     hypothesis_id: int
@@ -1,9 +1,18 @@
 
+import glob
+import os
+import time
 from pprint import pprint
-from typing import List
+from typing import Dict, List, Optional
 from Schemas.Accumulation import Context
 
+from Modules.Checkpoint import DFT_CHECKPOINT_DIR, config_fingerprint
 from Modules.Critic import Critic
+from Modules.Defaults import DFT_EMBEDDING_CACHE_PATH, DFT_LLM_MODEL, DFT_PERSIST_DIR
+from Modules.ExtractionCache import DFT_CACHE_DIR as DFT_EXTRACTION_CACHE_DIR
+from sray_ValidatedLLM.modules import telemetry
+from sray_ValidatedLLM.modules.cache import ResponseCache, set_response_cache
+from sray_ValidatedLLM.modules.constants import DataConstants
 
 # Initialize the critic only
 prompt_mapping = {
@@ -12,44 +21,177 @@ prompt_mapping = {
     "get_hypotheses": "Prompts/gapfinder_prompt2.txt",
     "design_experiments": "Prompts/designer_prompt1.txt"
 }
-critic = Critic(prompt_mapping=prompt_mapping)
+# Critiques run in the background and are collected by `critic.chastise()` each loop
+critic = Critic(prompt_mapping=prompt_mapping, background=True)
 
-def run(n_loops=5):
+# The validation corpus
+DFT_PDF_PATH = "./resources/validation/pdf"
+
+# Worker threads per stage when `run(streaming=True)`
+DFT_STAGE_WORKERS = {"gaps": 1, "hypotheses": 4, "designs": 4}
+
+def run(n_loops=5, telemetry_dir: Optional[str] = telemetry.DFT_TELEMETRY_DIR,
+        streaming: bool = False,
+        stage_workers: Optional[Dict[str, int]] = None,
+        queue_size: Optional[int] = None,
+        checkpoint_dir: Optional[str] = DFT_CHECKPOINT_DIR,
+        llm_model: str = DFT_LLM_MODEL,
+        pdf_path: str = DFT_PDF_PATH,
+        persist_dir: Optional[str] = DFT_PERSIST_DIR,
+        extraction_cache_dir: Optional[str] = DFT_EXTRACTION_CACHE_DIR,
+        embedding_cache_path: Optional[str] = DFT_EMBEDDING_CACHE_PATH,
+        response_cache_path: Optional[str] = DataConstants.DFT_RESPONSE_CACHE_PATH):
+    from Modules.Checkpoint import CheckpointStore
     from Modules.Designer import Designer
     from Modules.GapFinder import GapFinder
+    from Modules.Pipeline import DFT_QUEUE_SIZE, Stage, StreamingPipeline
     from Modules.ResearchAccumulator import ResearchAccumulator
     
     # This runs the workflow of accumulating research, finding gaps,
     # getting designs, and incorporating critiques `n_loops` times
     
-    pdf_path = "./resources/validation/pdf"
-    ra = ResearchAccumulator()
-    ctxs = ra.accumulate(dir=pdf_path)
+    # Serve repeated deterministic `prompt_LLM` calls (e.g. re-runs) from disk
+    set_response_cache(ResponseCache(response_cache_path) if response_cache_path is not None else None)
+    
+    # Where extracted text and embeddings are cached across runs; None disables either
+    ra = ResearchAccumulator(cache_dir=extraction_cache_dir)
 
     # Run the gap finder
     
     # FIXME: The constructors called here are incongruent with the actual constructors of each of these classes
-    research_accumulator = ResearchAccumulator()
-    gap_finder = GapFinder(init_contexts=ctxs, k=3, hypothesis_use_index=True)
-    designer = Designer()
-    
-    def _step():
-        contexts: List[Context] = research_accumulator.core()
-        hypotheses = gap_finder.core(contexts)
-        designs = designer.core(hypotheses)
+    # Every loop ingests the corpus itself (SEE `_step`), so the index starts from what's persisted
+    gap_finder = GapFinder(init_contexts=[], k=3, hypothesis_use_index=True, persist_dir=persist_dir,
+                           embedding_cache_path=embedding_cache_path, llm_model=llm_model)
+    designer = Designer(hypotheses=[], llm_model=llm_model)
+    
+    # Every stage's output is checkpointed under a hash of its inputs (and the
+    # loop number), so a rerun resumes at the first stage whose inputs changed
+    # or that never finished. None disables checkpointing.
+    checkpoints = CheckpointStore(checkpoint_dir) if checkpoint_dir is not None else None
+    # Part of every key, so switching the model, endpoint, retrieval/chunking
+    # settings or any prompt (the prompt files, and the GapFinder/Designer
+    # prompts in their `config()`) invalidates the checkpoints
+    config = config_fingerprint(
+        {"gap_finder": gap_finder.config(), "designer": designer.config(),
+         # What the critic's client will be configured from
+         "critic": {"model_id": os.environ.get("DEV_OPENAI_MODEL_ID"), "base_url": os.environ.get("OPENAI_BASE_URL")}},
+        files=glob.glob("Prompts/*.txt"))
+    
+    def _checkpointed(stage, inputs, fn, on_resume=None):
+        if checkpoints is None:
+            return fn()
+        return checkpoints.run(stage, (config, inputs), fn, on_resume=on_resume)
+    
+    def _chastise(loop_n, designs, reviews=()):
+        # Critiques are stored once the loop is done; resuming restores them.
+        # `reviews` are (function, output) pairs to critique on top of the ones
+        # the wrapped functions already submitted.
+        def _collect():
+            for func, output in reviews:
+                critic.review(func, output)
+            critic.chastise()
+            return critic.snapshot()
+        
+        def _resume(snapshot):
+            # The loop's critiques are already in the snapshot; the ones the
+            # wrapped functions queued this time around would be duplicates
+            critic.discard()
+            critic.restore(snapshot)
+        _checkpointed("critiques", (loop_n, designs), _collect, on_resume=_resume)
+    
+    def _step(loop_n):
+        # Re-read the corpus every loop, so papers added or removed since the
+        # last one are picked up; unchanged PDFs come from the extraction cache
+        ra.research.clear()
+        contexts: List[Context] = ra.accumulate(dir=pdf_path)
+        # Ingestion is idempotent and the store is persisted, so it isn't checkpointed
+        gap_finder.ingest(contexts)
+        gaps = _checkpointed("gaps", (loop_n, gap_finder.gap_mode, gap_finder.corpus_fingerprint()),
+                             gap_finder.new_gaps,
+                             on_resume=lambda gaps: gap_finder.remember(gaps=gaps))
+        hypotheses = _checkpointed("hypotheses", (loop_n, gaps),
+                                   lambda: gap_finder.new_hypotheses(gaps),
+                                   on_resume=lambda hypotheses: gap_finder.remember(hypotheses=hypotheses))
+        designs = _checkpointed("designs", (loop_n, hypotheses), lambda: designer.core(hypotheses))
         
         pprint([design for design in designs])
         
-        critic.chastise()
+        _chastise(loop_n, designs)
+    
+    if streaming:
+        # Papers -> gaps -> hypotheses -> designs through bounded queues, so each
+        # item moves on as soon as it exists rather than waiting on the whole stage
+        stage_workers = {**DFT_STAGE_WORKERS, **(stage_workers or {})}
+        queue_size = DFT_QUEUE_SIZE if queue_size is None else queue_size
+        
+        def _step(loop_n):
+            # Every stage's outputs, critiqued once at the end of the loop
+            # rather than item by item
+            all_gaps, all_hypotheses = [], []
+            
+            # Checkpointed per item: a resumed loop only recomputes the papers,
+            # gaps and hypotheses it hadn't finished
+            def _paper_to_gaps(paper):
+                def _resume(gaps):
+                    # Later stages still retrieve from the paper's chunks
+                    gap_finder._adds_papers_to_store([paper])
+                    gap_finder.remember(gaps=gaps)
+                gaps = _checkpointed("gaps", (loop_n, gap_finder.gap_mode, paper),
+                                     lambda: gap_finder.paper_to_gaps(paper), on_resume=_resume)
+                all_gaps.extend(gaps)
+                return gaps
+            
+            def _gap_to_hypotheses(gap):
+                hypotheses = _checkpointed("hypotheses", (loop_n, gap), lambda: gap_finder.gap_to_hypotheses(gap),
+                                           on_resume=lambda hypotheses: gap_finder.remember(hypotheses=hypotheses))
+                all_hypotheses.extend(hypotheses)
+                return hypotheses
+            
+            def _hypothesis_to_designs(hypothesis):
+                return _checkpointed("designs", (loop_n, hypothesis), lambda: designer.hypothesis_to_designs(hypothesis))
+            
+            pipeline = StreamingPipeline([
+                Stage("gaps", _paper_to_gaps, workers=stage_workers["gaps"], queue_size=queue_size),
+                Stage("hypotheses", _gap_to_hypotheses, workers=stage_workers["hypotheses"], queue_size=queue_size),
+                Stage("designs", _hypothesis_to_designs, workers=stage_workers["designs"], queue_size=queue_size),
+            ], queue_size=queue_size)
+            # Paper ids are hashed from the paths within the corpus, so unchanged
+            # papers keep their ids and aren't re-embedded
+            designs = []
+            for design in pipeline.run(ra.stream_papers(pdf_path)):
+                pprint(design)
+                designs.append(design)
+            print(pipeline.report())
+            
+            # Designs arrive in completion order; sort so the key doesn't depend on it
+            _chastise(loop_n, sorted(str(design) for design in designs),
+                      reviews=[(GapFinder.find_gaps, all_gaps),
+                               (GapFinder.get_hypotheses, all_hypotheses),
+                               (Designer.design_experiments, designs)])
         
     # Accumulate the research
+    total_loops = n_loops
     while n_loops > 0:
         print(f"> Loop {n_loops}...")
-        _step()
+        # Every LLM call in this step is tagged with the loop number
+        loop_n = total_loops - n_loops + 1
+        with telemetry.loop(loop_n):
+            _step(loop_n)
         n_loops -= 1
         
     print("Done.")
     
+    # Where the tokens, money and time went
+    print(telemetry.TELEMETRY.report(by="stage"))
+    print(telemetry.TELEMETRY.report(by="loop"))
+    if telemetry_dir is not None:
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        telemetry.TELEMETRY.export_jsonl(os.path.join(telemetry_dir, f"run-{run_id}.jsonl"))
+        telemetry.TELEMETRY.export_prometheus(os.path.join(telemetry_dir, f"run-{run_id}.prom"))
+    
+    if checkpoints is not None:
+        print(f"Checkpoints: {checkpoints.stats()}")
+    
     pprint(critic._critiques)
 
 
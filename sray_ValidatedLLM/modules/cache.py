@@ -0,0 +1,147 @@
+### RESPONSE CACHE
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sray_ValidatedLLM.modules.constants import DataConstants
+
+class ResponseCache:
+    """Cache of validated LLM responses, keyed on the full request.
+
+    The key covers everything sent to the model (model ID, messages,
+    response_format, max_tokens and sampling parameters) and the endpoint it
+    was sent to, so only truly identical requests hit. There are two tiers:
+
+    1. An in-memory LRU of `max_memory_entries` responses.
+    2. An optional SQLite file at `path`, capped at `max_disk_bytes` of
+       response text, evicting the least recently used rows first.
+
+    Entries older than `ttl` seconds (None = never) are treated as misses.
+    Only deterministic (temperature 0) requests should be cached; `prompt_LLM`
+    enforces that.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = DataConstants.DFT_RESPONSE_CACHE_PATH,
+                 max_memory_entries: int = DataConstants.DFT_RESPONSE_CACHE_MEMORY_ENTRIES,
+                 max_disk_bytes: int = DataConstants.DFT_RESPONSE_CACHE_DISK_BYTES,
+                 ttl: Optional[float] = DataConstants.DFT_RESPONSE_CACHE_TTL):
+        assert isinstance(max_memory_entries, int) and max_memory_entries > 0, "max_memory_entries must be a positive integer."
+        assert isinstance(max_disk_bytes, int) and max_disk_bytes > 0, "max_disk_bytes must be a positive integer."
+        assert ttl is None or ttl > 0, "ttl must be positive or None."
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # key -> (content, created_at)
+        self._memory = OrderedDict()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+        self._conn = None
+        self._disk_bytes = 0
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                               "(key TEXT PRIMARY KEY, content TEXT, created_at REAL, accessed_at REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._conn.commit()
+            self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(content)), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(request: dict) -> str:
+        # `sort_keys` so semantically identical requests hash identically
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                content, created_at = self._memory[key]
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return content
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    content, created_at = row
+                    if not self._expired(created_at, now):
+                        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        self._remember(key, content, created_at)
+                        self._stats["disk_hits"] += 1
+                        return content
+                    self._delete_row(key)
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, content: str) -> None:
+        assert isinstance(content, str), "Only raw response text is cached."
+        now = time.time()
+        with self._lock:
+            self._remember(key, content, now)
+            if self._conn is None:
+                return
+            self._delete_row(key)
+            self._conn.execute("INSERT INTO responses (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                               (key, content, now, now))
+            self._disk_bytes += len(content)
+            while self._disk_bytes > self.max_disk_bytes:
+                oldest = self._conn.execute("SELECT key FROM responses ORDER BY accessed_at LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._delete_row(oldest[0])
+                self._stats["evictions"] += 1
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    ### Helpers (callers hold `self._lock`)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key: str, content: str, created_at: float) -> None:
+        self._memory[key] = (content, created_at)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _delete_row(self, key: str) -> None:
+        row = self._conn.execute("SELECT LENGTH(content) FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._disk_bytes -= row[0] or 0
+
+### Process-wide default, used by `prompt_LLM` when no cache is passed
+
+_DEFAULT_CACHE: Optional[ResponseCache] = None
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Makes `cache` the default for every `prompt_LLM` call (None disables)."""
+    global _DEFAULT_CACHE
+    _DEFAULT_CACHE = cache
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _DEFAULT_CACHE
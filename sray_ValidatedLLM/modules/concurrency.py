@@ -0,0 +1,149 @@
+### CONCURRENCY UTILITIES
+
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+# How long `gather_bounded` pauses its limiter after a 429 without Retry-After
+DFT_RATE_LIMIT_BACKOFF = 2.0
+
+### Event Loop
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    # One process-wide loop on a daemon thread. Async clients (and their
+    # connection pools) are bound to the loop they were first used on, so
+    # reusing a single loop keeps them alive across calls.
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="async-llm-loop", daemon=True).start()
+    return _LOOP
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Run a coroutine to completion from synchronous code.
+
+    Unlike `asyncio.run`, this doesn't create (and tear down) an event loop per
+    call, and it works when the caller is already inside a running loop (e.g.
+    a notebook). Must not be called from a coroutine running on that loop.
+    """
+    loop = _background_loop()
+    assert threading.current_thread().name != "async-llm-loop", "run_sync would deadlock the background loop."
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+### Rate Limiting
+
+class RateLimiter:
+    """Async token bucket over requests and (optionally) tokens per minute.
+
+    `acquire` waits until both budgets allow the call. `pause` stops every
+    caller for a while, e.g. when the server answers with a 429.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        assert requests_per_minute is None or requests_per_minute > 0, "requests_per_minute must be positive or None."
+        assert tokens_per_minute is None or tokens_per_minute > 0, "tokens_per_minute must be positive or None."
+        # name -> [capacity, available]
+        self._buckets = {}
+        if requests_per_minute is not None:
+            self._buckets["requests"] = [float(requests_per_minute), float(requests_per_minute)]
+        if tokens_per_minute is not None:
+            self._buckets["tokens"] = [float(tokens_per_minute), float(tokens_per_minute)]
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: int = 0) -> None:
+        # Created lazily so it binds to the loop we're actually running on
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wanted = {"requests": 1.0, "tokens": float(tokens)}
+                wait = self._paused_until - now
+                for name, (capacity, available) in self._buckets.items():
+                    # A single request larger than the whole budget still gets through
+                    need = min(wanted[name], capacity)
+                    if available < need:
+                        wait = max(wait, (need - available) * 60.0 / capacity)
+                if wait <= 0:
+                    for name, bucket in self._buckets.items():
+                        bucket[1] -= min(wanted[name], bucket[0])
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        for bucket in self._buckets.values():
+            capacity, available = bucket
+            bucket[1] = min(capacity, available + elapsed * capacity / 60.0)
+
+def is_rate_limited(exception: BaseException) -> bool:
+    return getattr(exception, "status_code", None) == 429
+
+def retry_after_seconds(exception: BaseException) -> Optional[float]:
+    # openai's APIStatusError carries the httpx response
+    headers = getattr(getattr(exception, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+### Bounded Gather
+
+async def gather_bounded(fns: List[Callable[[], Awaitable[T]]],
+                         max_concurrency: int,
+                         rate_limiter: Optional[RateLimiter] = None,
+                         timeout: Optional[float] = None,
+                         token_costs: Optional[List[int]] = None) -> List[Union[T, BaseException]]:
+    """Run `fns` with at most `max_concurrency` in flight.
+
+    Args:
+        `fns` (List[Callable[[], Awaitable[T]]]):
+            Zero-argument coroutine factories, each only called once its turn
+            (and its rate-limit budget) comes up.
+        `max_concurrency` (int):
+            Maximum number of calls in flight at once.
+        `rate_limiter` (RateLimiter, optional):
+            Shared request/token budget. A rate-limited (429) call pauses the
+            limiter for Retry-After (or DFT_RATE_LIMIT_BACKOFF seconds), so the
+            calls still queued back off too. Calls aren't retried here; that is
+            left to the client's retry policy (SEE `retry.py`).
+        `timeout` (float, optional):
+            Per-call timeout in seconds.
+        `token_costs` (List[int], optional):
+            Estimated tokens per call, charged against the limiter's token budget.
+
+    Returns:
+        List[Union[T, BaseException]]:
+            One entry per input, in input order. A failed call yields its
+            exception instead of cancelling the others.
+    """
+    assert isinstance(max_concurrency, int) and max_concurrency > 0, "max_concurrency must be a positive integer."
+    assert token_costs is None or len(token_costs) == len(fns), "token_costs must line up with fns."
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(i: int, fn: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            if rate_limiter is not None:
+                await rate_limiter.acquire(token_costs[i] if token_costs is not None else 0)
+            try:
+                return await asyncio.wait_for(fn(), timeout=timeout)
+            except Exception as e:
+                if rate_limiter is not None and is_rate_limited(e):
+                    rate_limiter.pause(retry_after_seconds(e) or DFT_RATE_LIMIT_BACKOFF)
+                raise
+
+    return await asyncio.gather(*[_run(i, fn) for i, fn in enumerate(fns)], return_exceptions=True)
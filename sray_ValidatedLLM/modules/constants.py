@@ -23,6 +23,25 @@ class Constants:
 class DataConstants(Constants):
     MAX_TOKENS_INFERENCE = 4096
     DFT_LLM_RETRY_LIMIT = 2
+    DFT_LLM_MAX_CONCURRENCY = 8
+    # Retries for 429/5xx/connection errors, separate from DFT_LLM_RETRY_LIMIT
+    DFT_TRANSPORT_RETRY_LIMIT = 5
+    DFT_RETRY_BASE_DELAY = 1.0
+    DFT_RETRY_MAX_DELAY = 60.0
+    
+    DFT_RESPONSE_CACHE_PATH = ".cache/llm_responses.sqlite"
+    DFT_RESPONSE_CACHE_MEMORY_ENTRIES = 1024
+    DFT_RESPONSE_CACHE_DISK_BYTES = 256 * 1024 * 1024
+    DFT_RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+    
+    # Connection pool shared by every client from `configure_openai`
+    DFT_HTTP_MAX_CONNECTIONS = 64
+    DFT_HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+    DFT_HTTP_KEEPALIVE_EXPIRY = 60.0  # seconds
+    DFT_HTTP_TIMEOUT = 600.0  # seconds, the openai SDK's default
+    
+    # Recorded responses for offline runs (SEE `modules/transport.py`)
+    DFT_CASSETTE_DIR = ".cache/cassettes"
 
     DFT_MODEL_IDS_SUPPORTED = ("AZURE_GPT4o_MODEL_ID", "AZURE_GPT4_TURBO_MODEL_ID")
     
@@ -34,4 +53,10 @@ class DataConstants(Constants):
         super().__init__()
         self.add_assertion(self.MAX_TOKENS_INFERENCE > 0, "MAX_TOKENS_INFERENCE must be greater than 0")
         self.add_assertion(self.DFT_LLM_RETRY_LIMIT > 0, "DFT_LLM_RETRY_LIMIT must be greater than 0")
+        self.add_assertion(self.DFT_LLM_MAX_CONCURRENCY > 0, "DFT_LLM_MAX_CONCURRENCY must be greater than 0")
+        self.add_assertion(self.DFT_TRANSPORT_RETRY_LIMIT >= 0, "DFT_TRANSPORT_RETRY_LIMIT must be non-negative")
+        self.add_assertion(0 < self.DFT_RETRY_BASE_DELAY <= self.DFT_RETRY_MAX_DELAY, "Need 0 < DFT_RETRY_BASE_DELAY <= DFT_RETRY_MAX_DELAY")
+        self.add_assertion(0 < self.DFT_HTTP_MAX_KEEPALIVE_CONNECTIONS <= self.DFT_HTTP_MAX_CONNECTIONS, "Need 0 < DFT_HTTP_MAX_KEEPALIVE_CONNECTIONS <= DFT_HTTP_MAX_CONNECTIONS")
+        self.add_assertion(self.DFT_HTTP_KEEPALIVE_EXPIRY > 0, "DFT_HTTP_KEEPALIVE_EXPIRY must be greater than 0")
+        self.add_assertion(self.DFT_HTTP_TIMEOUT > 0, "DFT_HTTP_TIMEOUT must be greater than 0")
         self.validate()
\ No newline at end of file
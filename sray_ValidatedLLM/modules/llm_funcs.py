@@ -1,10 +1,15 @@
 import json
 from pprint import pprint
-from typing import Any, Optional, Type, Union
+from typing import Any, Callable, List, Optional, Type, Union
 
 import openai
 from sray_ValidatedLLM.modules.utilities import fmt, path_exists, path_is_file, wrap_for_unpacking
 from sray_ValidatedLLM.modules.constants import DataConstants
+from sray_ValidatedLLM.modules.cache import ResponseCache, get_response_cache
+from sray_ValidatedLLM.modules.concurrency import RateLimiter, gather_bounded, run_sync
+from sray_ValidatedLLM.modules.prompts import PROMPT_REGISTRY, CompiledPrompt
+from sray_ValidatedLLM.modules.retry import RetryPolicy, acall_with_retries, call_with_retries
+from sray_ValidatedLLM.modules.telemetry import CallMeter
 
 import aiohttp
 import asyncio
@@ -79,6 +84,102 @@ def _validate_response_format(received_output: Union[str, dict],
             raise ResponseValidationException(_ERR_MSG(received_output))
     return received_output
 
+def _validate_prompt_args(prompt: str,
+                          base64_image: Optional[str],
+                          desired_format: Optional[str],
+                          max_tokens: int,
+                          force_raw: bool,
+                          validate_func: Optional[Callable]) -> None:
+    assert isinstance(prompt, str), "Prompt must be a string, representing a file path or a raw prompt string."
+    assert isinstance(base64_image, str) or base64_image is None, "Base64 image must be a string or None."
+    if base64_image is not None:
+        assert len(base64_image) > 0, "Base64 image must not be empty."
+    assert isinstance(max_tokens, int) and (0 < max_tokens <= DataConstants.MAX_TOKENS_INFERENCE), f"Max tokens must be an integer between 0 and {DataConstants.MAX_TOKENS_INFERENCE}."
+    assert desired_format == "json" or desired_format is None, "Desired format must be 'json' or None. Allows for experimentation."
+    assert isinstance(force_raw, bool), "Force raw must be a boolean."
+    assert validate_func is None or callable(validate_func), "Validate function must be a callable function or None."
+
+def _build_request(model_id: str,
+                   prompt: str,
+                   base64_image: Optional[str],
+                   desired_format: Optional[str],
+                   max_tokens: int,
+                   force_raw: bool,
+                   system_prompt: Optional[str]) -> dict:
+    # Keyword arguments for `client.chat.completions.create`, shared by the
+    # sync and async paths.
+    prompt = load_prompt(prompt, force_raw=force_raw)
+    
+    IMG_CONTENT = _safe_img_format(base64_image)
+    PROMPT_CONTENT = _safe_prompt_format(prompt)
+    RESPONSE_FORMAT = _safe_response_format(desired_format, prompt)
+    
+    _SYSTEM_PROMPT = {
+        "role": "system",
+        "content": system_prompt
+    } if system_prompt else None
+    _SYSTEM_PROMPT = wrap_for_unpacking(_SYSTEM_PROMPT)
+    
+    # TODO: Minor, make these LLM args parameters
+    return dict(
+        temperature=0,
+        max_tokens=max_tokens,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0,
+        model=model_id,
+        messages=[
+            {
+                "role": "user",
+                "content": [*PROMPT_CONTENT, *IMG_CONTENT],
+            },
+            *_SYSTEM_PROMPT
+        ],
+        **RESPONSE_FORMAT
+    )
+
+def _check_response(content: str, desired_format: Optional[str], validate_func: Optional[Callable]) -> Union[str, dict]:
+    # Raises if the response text fails the built-in or custom validation
+    response = _validate_response_format(content,
+                                         desired_format=desired_format)
+    custom_output: bool = validate_func(response) if validate_func is not None else True
+    if not custom_output:
+        raise ResponseValidationException(f"Custom validation failed for response:\n{response}")
+    return response
+
+class _CachedRequest:
+    # Wires a `ResponseCache` around one request: serves a cached response if
+    # it still validates, and stores a fresh one once it has.
+    def __init__(self, request: dict, cache: Optional[ResponseCache],
+                 desired_format: Optional[str], validate_func: Optional[Callable],
+                 base_url: Optional[str] = None):
+        self.desired_format = desired_format
+        self.validate_func = validate_func
+        # Non-deterministic requests are never cached
+        self.cache = cache if request.get("temperature") == 0 else None
+        # Keyed on the endpoint too, so e.g. a stub server's answers are never
+        # served to runs against the real API
+        self.key = ResponseCache.key({**request, "base_url": base_url}) if self.cache is not None else None
+
+    def lookup(self) -> Optional[Union[str, dict]]:
+        if self.cache is None:
+            return None
+        content = self.cache.get(self.key)
+        if content is None:
+            return None
+        try:
+            return _check_response(content, self.desired_format, self.validate_func)
+        except Exception:
+            # e.g. the validation function changed since this was cached
+            return None
+
+    def check(self, response) -> Union[str, dict]:
+        content = response.choices[0].message.content
+        checked = _check_response(content, self.desired_format, self.validate_func)
+        if self.cache is not None:
+            self.cache.put(self.key, content)
+        return checked
+
 ### CORE FUNCTIONS
 
 def load_prompt(prompt: str,
@@ -92,8 +193,10 @@ def load_prompt(prompt: str,
             prompt.
         `substitutions` (dict[str, Any], optional):
             A dictionary of substitutions to be applied to the prompt. 
-            The keys are phrases to find in the prompt, and the values are the
-            substitutions to replace them with.
+            The keys name `{{PLACEHOLDER}}` slots in the prompt (with or
+            without the braces), and the values are the substitutions to fill
+            them with. Keys that aren't slots are treated as phrases to find
+            and replace.
             Defaults to None.
         `force_raw` (bool, optional):
             If True, treat the `prompt` as a raw string
@@ -105,26 +208,19 @@ def load_prompt(prompt: str,
     """
     
     # Either get prompt from file or from a raw string entered as a raw string.
+    # Files are compiled once and re-read only when they change on disk.
     if not force_raw:
         assert path_exists(prompt) and path_is_file(prompt), f"Prompt file {prompt} does not exist or is not a file."
-        with open(prompt, "r") as f:
-            prompt = f.read()
-    assert prompt != "", "Prompt from manual user input or from file can't be empty."
-    assert isinstance(prompt, str), "Prompt must be a string."
+        template = PROMPT_REGISTRY.get(prompt)
+    else:
+        assert isinstance(prompt, str), "Prompt must be a string."
+        template = CompiledPrompt(prompt)
+    assert template.text != "", "Prompt from manual user input or from file can't be empty."
     assert substitutions is None or isinstance(substitutions, dict), "Substitutions must be a dictionary or None."
     assert isinstance(force_raw, bool), "Force raw must be a boolean."
     
-    # Apply substitutions to prompt
-    if substitutions is not None:
-        for phrase_to_find, substitution in substitutions.items():
-            assert isinstance(phrase_to_find, str), f"phrase to find in prompt must be a string, got {phrase_to_find}"
-            if substitution in ("", {}, None):
-                substitution = "[IGNORE: Referred information not available, please ignore this part.]"
-            else:
-                substitution = json.dumps(substitution, indent=4) if isinstance(substitution, dict) else str(substitution)
-            prompt = prompt.replace(phrase_to_find, substitution)
-    
-    return prompt
+    # Apply substitutions to prompt in a single pass over its `{{PLACEHOLDER}}` slots
+    return PROMPT_REGISTRY.render(template, substitutions)
 
 # Decorator for showing input and output for `prompt_LLM` function
 def show_io(func):
@@ -143,19 +239,6 @@ def show_io(func):
     return wrapper
 
 
-# async def async_prompt_LLM(**kwargs) -> Union[str, dict]:
-#     max_retry = 5
-#     output = [""] * len(prompts)
-#     while max_retry > 0:
-#         try:
-#             batch_responses = await asyncio.gather(
-#                 *[async_apply(p, **kwargs) for p in prompts]
-#             )
-#             return batch_responses
-#         except Exception as ex:
-#             print(ex)
-#             return output
-
 def prompt_LLM(client: Union[openai.lib.azure.AzureOpenAI, openai.OpenAI],
                model_id: str,
                prompt: str,
@@ -165,7 +248,9 @@ def prompt_LLM(client: Union[openai.lib.azure.AzureOpenAI, openai.OpenAI],
                force_raw: bool = False,
                validate_func: object = None,
                num_retry: int = DataConstants.DFT_LLM_RETRY_LIMIT,
-               system_prompt: str = None) -> Union[str, dict]:
+               system_prompt: str = None,
+               retry_policy: Optional[RetryPolicy] = None,
+               cache: Optional[ResponseCache] = None) -> Union[str, dict]:
     """
     
     `prompt_LLM` does basic validation of the response format depending on the
@@ -225,14 +310,33 @@ def prompt_LLM(client: Union[openai.lib.azure.AzureOpenAI, openai.OpenAI],
             
             Defaults to DataConstants.DFT_LLM_RETRY_LIMIT.
 
+        `system_prompt` (str, optional):
+            System message sent along with the prompt (on every attempt).
+            Defaults to None.
+
+        `retry_policy` (RetryPolicy, optional):
+            Budget and backoff for transport failures (429s, 5xx, timeouts,
+            dropped connections). These are retried with exponential backoff
+            plus jitter, honoring Retry-After, and do NOT count against
+            `num_retry`. Other request errors are raised immediately.
+            Defaults to `retry.DFT_RETRY_POLICY`.
+
+        `cache` (ResponseCache, optional):
+            Serves identical deterministic requests (same model, messages,
+            response_format, max_tokens, ...) from a local cache instead of
+            the LLM. Cached responses still go through validation.
+            Defaults to the process-wide cache set with
+            `cache.set_response_cache`, if any.
+
     Raises:
-        `ResponseValidationException`:
-            Raised if the response is not in the `desired_format` after all
-            specified retries.
+        Request errors that aren't transient, and transient ones once
+        `retry_policy` is exhausted. Validation failures are never raised.
 
     Returns:
         Union[str, dict]:
             Could be a string or a dictionary, depending on `desired_format`.
+            None if the response is still not in the `desired_format` (or
+            fails `validate_func`) after `num_retry` attempts.
     """
     
     # TODO: Add an assertion cross-referencing the model_id with desired_format.
@@ -240,96 +344,140 @@ def prompt_LLM(client: Union[openai.lib.azure.AzureOpenAI, openai.OpenAI],
     #       which we may not host on Azure, need to double check.
     
     # assert isinstance(client, openai.lib.azure.AzureOpenAI), "Client must be an instance of the OpenAI client."
-    assert isinstance(prompt, str), "Prompt must be a string, representing a file path or a raw prompt string."
-    assert isinstance(base64_image, str) or base64_image is None, "Base64 image must be a string or None."
-    if base64_image is not None:
-        assert len(base64_image) > 0, "Base64 image must not be empty."
-    assert isinstance(max_tokens, int) and (0 < max_tokens <= DataConstants.MAX_TOKENS_INFERENCE), f"Max tokens must be an integer between 0 and {DataConstants.MAX_TOKENS_INFERENCE}."
-    assert desired_format == "json" or desired_format is None, "Desired format must be 'json' or None. Allows for experimentation."
-    assert isinstance(force_raw, bool), "Force raw must be a boolean."
-    assert validate_func is None or callable(validate_func), "Validate function must be a callable function or None."
+    _validate_prompt_args(prompt, base64_image, desired_format, max_tokens, force_raw, validate_func)
     if not (isinstance(num_retry, int) and num_retry > 0):
         print(fmt("No retries are left to execute LLM call.", n="red"))
         return None
     
-    prompt = load_prompt(prompt, force_raw=force_raw)
+    request = _build_request(model_id, prompt, base64_image, desired_format, max_tokens, force_raw, system_prompt)
+    meter = CallMeter(model_id)
+    cached_request = _CachedRequest(request, cache or get_response_cache(), desired_format, validate_func,
+                                    base_url=str(client.base_url))
+    cached = cached_request.lookup()
+    if cached is not None:
+        print(fmt("Response served from cache.", n="green"))
+        meter.finish(succeeded=True, cache_hit=True)
+        return cached
     
-    IMG_CONTENT = _safe_img_format(base64_image)
-    PROMPT_CONTENT = _safe_prompt_format(prompt)
-    RESPONSE_FORMAT = _safe_response_format(desired_format, prompt)
+    def _send():
+        meter.attempt()
+        if isinstance(client, openai.AsyncOpenAI):
+            print(fmt("Asynchronous call to LLM.", n="green"))
+            # Runs on the shared background loop, so the client's connection pool
+            # survives between calls (no per-call `asyncio.run`)
+            response = run_sync(client.chat.completions.create(**request))
+        else:
+            print(fmt("Synchronous call to LLM.", n="green"))
+            response = client.chat.completions.create(**request)
+        print(fmt("Response received from LLM.", n="green"))
+        meter.add_response(response)
+        return response
     
-    _SYSTEM_PROMPT = {
-        "role": "system",
-        "content": system_prompt
-    } if system_prompt else None
-    _SYSTEM_PROMPT = wrap_for_unpacking(_SYSTEM_PROMPT)
+    result = None
+    try:
+        result = call_with_retries(_send,
+                                   check=cached_request.check,
+                                   validation_attempts=num_retry,
+                                   policy=retry_policy)
+    finally:
+        meter.finish(succeeded=result is not None)
+    return result
+
+async def aprompt_LLM(client: openai.AsyncOpenAI,
+                      model_id: str,
+                      prompt: str,
+                      base64_image: Optional[str] = None,
+                      desired_format: Optional[str] = None,
+                      max_tokens=DataConstants.MAX_TOKENS_INFERENCE,
+                      force_raw: bool = False,
+                      validate_func: object = None,
+                      num_retry: int = DataConstants.DFT_LLM_RETRY_LIMIT,
+                      system_prompt: str = None,
+                      retry_policy: Optional[RetryPolicy] = None,
+                      cache: Optional[ResponseCache] = None) -> Union[str, dict]:
+    """
     
-    # TODO: Minor, make these LLM args parameters
-    async def asynch_response(max_tokens, model_id):
-        return await client.chat.completions.create(
-            temperature=0,
-            max_tokens=max_tokens,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0,
-            model=model_id,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [*PROMPT_CONTENT, *IMG_CONTENT],
-                },
-                *_SYSTEM_PROMPT
-            ],
-            **RESPONSE_FORMAT
-        )
+    Native async counterpart of `prompt_LLM` for `openai.AsyncOpenAI`
+    clients. Takes the same arguments and applies the same validation and
+    retry semantics (SEE `prompt_LLM`), but awaits the request instead of
+    blocking, so it can be used from inside a running event loop and many
+    calls can share one client and its connection pool.
+    """
+    assert isinstance(client, openai.AsyncOpenAI), "aprompt_LLM requires an `openai.AsyncOpenAI` client. Use `prompt_LLM` otherwise."
+    _validate_prompt_args(prompt, base64_image, desired_format, max_tokens, force_raw, validate_func)
     
-    def synch_response(max_tokens, model_id):
-        return client.chat.completions.create(
-            temperature=0,
-            max_tokens=max_tokens,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0,
-            model=model_id,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [*PROMPT_CONTENT, *IMG_CONTENT],
-                },
-                *_SYSTEM_PROMPT
-            ],
-            **RESPONSE_FORMAT
-        )
+    if not (isinstance(num_retry, int) and num_retry > 0):
+        print(fmt("No retries are left to execute LLM call.", n="red"))
+        return None
     
-    if isinstance(client, openai.AsyncOpenAI):
-        print(fmt("Asynchronous call to LLM.", n="green"))
-    else:
-        print(fmt("Synchronous call to LLM.", n="green"))
-    response = asyncio.run(asynch_response(max_tokens, model_id)) if isinstance(client, openai.AsyncOpenAI) else synch_response(max_tokens, model_id)
+    request = _build_request(model_id, prompt, base64_image, desired_format, max_tokens, force_raw, system_prompt)
+    meter = CallMeter(model_id)
+    cached_request = _CachedRequest(request, cache or get_response_cache(), desired_format, validate_func,
+                                    base_url=str(client.base_url))
+    cached = cached_request.lookup()
+    if cached is not None:
+        meter.finish(succeeded=True, cache_hit=True)
+        return cached
+    
+    async def _send():
+        meter.attempt()
+        response = await client.chat.completions.create(**request)
+        meter.add_response(response)
+        return response
     
-    print(fmt("Response received from LLM.", n="green"))
+    result = None
     try:
-        response = _validate_response_format(response.choices[0].message.content,
-                                             desired_format=desired_format)
-        custom_output: bool = validate_func(response) if validate_func is not None else True
-        if not custom_output:
-            raise ResponseValidationException(f"Custom validation failed for response:\n{response}")
-    except (Exception) as rve:
-        print(fmt(f"Validation failed. RETRY {DataConstants.DFT_LLM_RETRY_LIMIT - num_retry + 1} of {num_retry}.", n="yellow"))
-        print(rve)
-        # Retry the function call, if any retries are left
-        if num_retry > 0:
-            num_retry = num_retry - 1
-            return prompt_LLM(client=client,
-                              model_id=model_id,
-                              base64_image=base64_image,
-                              desired_format=desired_format,
-                              max_tokens=max_tokens,
-                              prompt=prompt,
-                              force_raw=force_raw,
-                              validate_func=validate_func,
-                              num_retry=num_retry)
-        else:
-            msg = fmt(f"Validation failed after {DataConstants.DFT_LLM_RETRY_LIMIT} retries. Last error: {rve}", n="red")
-            raise ResponseValidationException(msg)
-    return response
\ No newline at end of file
+        result = await acall_with_retries(_send,
+                                          check=cached_request.check,
+                                          validation_attempts=num_retry,
+                                          policy=retry_policy)
+    finally:
+        meter.finish(succeeded=result is not None)
+    return result
+
+async def aprompt_LLM_many(client: Union[openai.AsyncOpenAI, openai.OpenAI, openai.lib.azure.AzureOpenAI],
+                           model_id: str,
+                           prompts: List[str],
+                           max_concurrency: int = DataConstants.DFT_LLM_MAX_CONCURRENCY,
+                           rate_limiter: Optional[RateLimiter] = None,
+                           **kwargs) -> List[Union[str, dict, None, BaseException]]:
+    """Runs `prompt_LLM` over `prompts` concurrently on one shared client.
+
+    Args:
+        `client` (Union[openai.AsyncOpenAI, openai.OpenAI, openai.lib.azure.AzureOpenAI]):
+            Async clients are awaited natively; sync clients are fanned out
+            over threads.
+        `model_id` (str):
+            The model ID to use.
+        `prompts` (List[str]):
+            The prompts. Each is treated exactly like `prompt` in `prompt_LLM`.
+        `max_concurrency` (int, optional):
+            Maximum number of requests in flight.
+            Defaults to DataConstants.DFT_LLM_MAX_CONCURRENCY.
+        `rate_limiter` (RateLimiter, optional):
+            Optional request budget shared across the batch.
+        `**kwargs`:
+            Any other `prompt_LLM` argument, applied to every prompt.
+
+    Returns:
+        List[Union[str, dict, None, BaseException]]:
+            One result per prompt, in order. A prompt that raised yields its
+            exception instead of failing the whole batch.
+    """
+    if isinstance(client, openai.AsyncOpenAI):
+        fns = [lambda p=p: aprompt_LLM(client, model_id, p, **kwargs) for p in prompts]
+    else:
+        fns = [lambda p=p: asyncio.to_thread(prompt_LLM, client, model_id, p, **kwargs) for p in prompts]
+    return await gather_bounded(fns, max_concurrency=max_concurrency, rate_limiter=rate_limiter)
+
+def prompt_LLM_many(client: Union[openai.AsyncOpenAI, openai.OpenAI, openai.lib.azure.AzureOpenAI],
+                    model_id: str,
+                    prompts: List[str],
+                    max_concurrency: int = DataConstants.DFT_LLM_MAX_CONCURRENCY,
+                    rate_limiter: Optional[RateLimiter] = None,
+                    **kwargs) -> List[Union[str, dict, None, BaseException]]:
+    """Blocking wrapper around `aprompt_LLM_many`; SEE its docstring."""
+    return run_sync(aprompt_LLM_many(client, model_id, prompts,
+                                     max_concurrency=max_concurrency,
+                                     rate_limiter=rate_limiter,
+                                     **kwargs))
@@ -0,0 +1,108 @@
+### PROMPT TEMPLATES
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# `{{NAME}}` placeholder slots in prompt files
+_SLOT = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+IGNORE_SUBSTITUTION = "[IGNORE: Referred information not available, please ignore this part.]"
+
+def format_substitution(value: Any) -> str:
+    if value in ("", {}, None):
+        return IGNORE_SUBSTITUTION
+    return json.dumps(value, indent=4) if isinstance(value, dict) else str(value)
+
+class CompiledPrompt:
+    """A prompt pre-split into literal text and `{{NAME}}` slots.
+
+    Rendering is a single join over the pieces, rather than one full copy of
+    the prompt per substitution.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        # re.split with one group alternates: literal, slot, literal, ..., literal
+        pieces = _SLOT.split(text)
+        self._literals: List[str] = pieces[0::2]
+        self._slots: List[str] = pieces[1::2]
+        self.slot_names = frozenset(self._slots)
+
+    def render(self, substitutions: Optional[Dict[str, Any]] = None) -> str:
+        """Fills the slots from `substitutions`.
+
+        Keys may be given as `NAME` or `{{NAME}}`. Slots without a value are
+        left untouched. Keys that don't name a slot fall back to plain
+        find-and-replace on the rendered text, like `load_prompt` always did.
+        """
+        if not substitutions:
+            return self.text
+
+        slot_values, phrases = {}, {}
+        for key, value in substitutions.items():
+            assert isinstance(key, str), f"phrase to find in prompt must be a string, got {key}"
+            slot = _SLOT.fullmatch(key)
+            name = slot.group(1) if slot else key
+            if name in self.slot_names:
+                slot_values[name] = format_substitution(value)
+            else:
+                phrases[key] = format_substitution(value)
+
+        parts = [self._literals[0]]
+        for slot, literal in zip(self._slots, self._literals[1:]):
+            parts.append(slot_values.get(slot, f"{{{{{slot}}}}}"))
+            parts.append(literal)
+        rendered = "".join(parts)
+
+        for phrase, value in phrases.items():
+            rendered = rendered.replace(phrase, value)
+        return rendered
+
+class PromptRegistry:
+    """Loads and compiles each prompt file once.
+
+    A file is re-read only when its mtime or size changes, so edits are picked
+    up without restarting. `stats()` exposes load/hit counts and render timing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> ((mtime_ns, size), CompiledPrompt)
+        self._templates: Dict[str, Tuple[Tuple[int, int], CompiledPrompt]] = {}
+        self._stats = {"loads": 0, "hits": 0, "renders": 0, "render_seconds": 0.0}
+
+    def get(self, path: str) -> CompiledPrompt:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._templates.get(path)
+            if entry is not None and entry[0] == version:
+                self._stats["hits"] += 1
+                return entry[1]
+        with open(path, "r") as f:
+            template = CompiledPrompt(f.read())
+        with self._lock:
+            self._templates[path] = (version, template)
+            self._stats["loads"] += 1
+        return template
+
+    def render(self, template: CompiledPrompt, substitutions: Optional[Dict[str, Any]] = None) -> str:
+        start = time.perf_counter()
+        rendered = template.render(substitutions)
+        with self._lock:
+            self._stats["renders"] += 1
+            self._stats["render_seconds"] += time.perf_counter() - start
+        return rendered
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["templates"] = len(self._templates)
+        stats["mean_render_us"] = 1e6 * stats["render_seconds"] / stats["renders"] if stats["renders"] else 0.0
+        return stats
+
+PROMPT_REGISTRY = PromptRegistry()
@@ -0,0 +1,194 @@
+### RETRY ENGINE
+
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from sray_ValidatedLLM.modules.concurrency import retry_after_seconds
+from sray_ValidatedLLM.modules.constants import DataConstants
+from sray_ValidatedLLM.modules.utilities import fmt
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, conflicts, throttling and server errors
+_TRANSIENT_STATUS_CODES = (408, 409, 429)
+
+class RetryPolicy:
+    """How to retry an LLM call.
+
+    Transport failures (429s, 5xx, timeouts, dropped connections) and
+    validation failures (the model answered, but not in the shape we wanted)
+    have separate budgets. Transport failures back off exponentially with
+    full jitter, or wait exactly as long as the server's Retry-After says.
+    Validation failures are retried straight away, since the endpoint is fine.
+    """
+
+    def __init__(self,
+                 max_transport_retries: int = DataConstants.DFT_TRANSPORT_RETRY_LIMIT,
+                 base_delay: float = DataConstants.DFT_RETRY_BASE_DELAY,
+                 max_delay: float = DataConstants.DFT_RETRY_MAX_DELAY):
+        assert isinstance(max_transport_retries, int) and max_transport_retries >= 0, "max_transport_retries must be a non-negative integer."
+        assert 0 < base_delay <= max_delay, "Need 0 < base_delay <= max_delay."
+        self.max_transport_retries = max_transport_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+class RetryMetrics:
+    """Process-wide counters for `prompt_LLM` attempts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+            self.failures = 0
+            self.transport_retries = 0
+            self.validation_retries = 0
+            self.seconds_backing_off = 0.0
+            # attempts per call -> number of calls
+            self.attempts = Counter()
+
+    def record(self, transport_retries: int, validation_retries: int, backoff: float, succeeded: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.failures += not succeeded
+            self.transport_retries += transport_retries
+            self.validation_retries += validation_retries
+            self.seconds_backing_off += backoff
+            self.attempts[1 + transport_retries + validation_retries] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total_attempts = sum(n * count for n, count in self.attempts.items())
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "transport_retries": self.transport_retries,
+                "validation_retries": self.validation_retries,
+                "seconds_backing_off": self.seconds_backing_off,
+                "mean_attempts_per_call": total_attempts / self.calls if self.calls else 0.0,
+                "attempts_histogram": dict(sorted(self.attempts.items())),
+            }
+
+DFT_RETRY_POLICY = RetryPolicy()
+RETRY_METRICS = RetryMetrics()
+
+def is_transient(exception: BaseException) -> bool:
+    """True for errors where the same request may well succeed later."""
+    # Imported here so the engine doesn't force the openai import on its users
+    import openai
+    if isinstance(exception, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    status_code = getattr(exception, "status_code", None)
+    return isinstance(status_code, int) and (status_code in _TRANSIENT_STATUS_CODES or status_code >= 500)
+
+class _Attempts:
+    # Bookkeeping shared by the sync and async loops below
+    def __init__(self, validation_attempts: int, policy: RetryPolicy):
+        self.validation_attempts = validation_attempts
+        self.policy = policy
+        self.transport_retries = 0
+        self.validation_failures = 0
+        self.backoff = 0.0
+
+    def on_transport_error(self, e: Exception) -> Optional[float]:
+        """Returns how long to wait before retrying, or None to give up."""
+        if not is_transient(e) or self.transport_retries >= self.policy.max_transport_retries:
+            self.finish(succeeded=False)
+            return None
+        delay = self.policy.backoff(self.transport_retries, retry_after_seconds(e))
+        self.transport_retries += 1
+        self.backoff += delay
+        print(fmt(f"Transient error ({type(e).__name__}). Backing off {delay:.2f}s, "
+                  f"transport retry {self.transport_retries} of {self.policy.max_transport_retries}.", n="yellow"))
+        return delay
+
+    def on_validation_error(self, rve: Exception) -> bool:
+        """Returns whether another attempt is allowed."""
+        self.validation_failures += 1
+        print(fmt(f"Validation failed. RETRY {self.validation_failures} of {self.validation_attempts}.", n="yellow"))
+        print(rve)
+        if self.validation_failures >= self.validation_attempts:
+            print(fmt("No retries are left to execute LLM call.", n="red"))
+            # The last failure didn't lead to another attempt
+            self.finish(succeeded=False, validation_retries=self.validation_failures - 1)
+            return False
+        return True
+
+    def finish(self, succeeded: bool, validation_retries: Optional[int] = None) -> None:
+        if validation_retries is None:
+            validation_retries = self.validation_failures
+        RETRY_METRICS.record(self.transport_retries, validation_retries, self.backoff, succeeded)
+
+def call_with_retries(send: Callable[[], Any],
+                      check: Callable[[Any], T],
+                      validation_attempts: int,
+                      policy: Optional[RetryPolicy] = None) -> Optional[T]:
+    """Calls `send()` and validates its result with `check`, retrying per `policy`.
+
+    Args:
+        `send` (Callable[[], Any]):
+            Issues the request. Transient exceptions are retried with backoff,
+            anything else propagates.
+        `check` (Callable[[Any], T]):
+            Validates/parses the raw response; raising triggers a retry.
+        `validation_attempts` (int):
+            How many responses may be checked before giving up.
+        `policy` (RetryPolicy, optional):
+            Defaults to DFT_RETRY_POLICY.
+
+    Returns:
+        Optional[T]: The checked response, or None if validation never passed.
+    """
+    state = _Attempts(validation_attempts, policy or DFT_RETRY_POLICY)
+    while True:
+        try:
+            response = send()
+        except Exception as e:
+            delay = state.on_transport_error(e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        try:
+            result = check(response)
+        except Exception as rve:
+            if state.on_validation_error(rve):
+                continue
+            return None
+        state.finish(succeeded=True)
+        return result
+
+async def acall_with_retries(send: Callable[[], Awaitable[Any]],
+                             check: Callable[[Any], T],
+                             validation_attempts: int,
+                             policy: Optional[RetryPolicy] = None) -> Optional[T]:
+    """Async version of `call_with_retries`; `send` returns an awaitable."""
+    state = _Attempts(validation_attempts, policy or DFT_RETRY_POLICY)
+    while True:
+        try:
+            response = await send()
+        except Exception as e:
+            delay = state.on_transport_error(e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        try:
+            result = check(response)
+        except Exception as rve:
+            if state.on_validation_error(rve):
+                continue
+            return None
+        state.finish(succeeded=True)
+        return result
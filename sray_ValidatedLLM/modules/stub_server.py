@@ -0,0 +1,313 @@
+### LOCAL STAND-IN FOR THE OPENAI API
+
+"""An OpenAI-compatible server for offline runs, benchmarks and load tests.
+
+Serves chat completions (including tool calls and JSON-schema response
+formats, answered with a minimal instance of the requested schema), legacy
+completions and the model list, with configurable latency and injected
+errors. Needs nothing beyond the standard library.
+
+Run from the repository root:
+    python -m sray_ValidatedLLM.modules.stub_server [--port 8000] [--latency 0.5] [--error-rate 0.05]
+
+then point the clients at it with the environment variables it prints, or
+in-process:
+    with StubOpenAIServer(latency=0.2) as server:
+        os.environ.update(server.environ())
+        ...
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from sray_ValidatedLLM.modules.utilities import estimate_tokens
+
+DFT_STUB_MODEL = "gpt-4o-mini"
+
+# Returns the assistant's message content for a chat request body
+Responder = Callable[[dict], str]
+
+def example_from_schema(schema: dict, defs: Optional[dict] = None) -> Any:
+    """A minimal value that validates against JSON `schema` (as emitted by
+    pydantic): one item per array, the first option of every union/enum."""
+    defs = {**(defs or {}), **schema.get("$defs", {}), **schema.get("definitions", {})}
+    if "$ref" in schema:
+        return example_from_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    for union in ("anyOf", "oneOf", "allOf"):
+        if union in schema:
+            options = [option for option in schema[union] if option.get("type") != "null"] or schema[union]
+            return example_from_schema(options[0], defs)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "default" in schema:
+        return schema["default"]
+
+    kind = schema.get("type", "object" if "properties" in schema else "string")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {name: example_from_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [example_from_schema(schema.get("items", {}), defs) for _ in range(max(schema.get("minItems", 1), 1))]
+    return {"integer": 1, "number": 1.0, "boolean": True, "null": None}.get(kind, "stub")
+
+def default_responder(body: dict) -> str:
+    """Valid JSON for JSON response formats, a short deterministic text otherwise."""
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return json.dumps(example_from_schema(response_format["json_schema"].get("schema", {})))
+    if response_format.get("type") == "json_object":
+        return json.dumps({"stub": True})
+    messages = body.get("messages") or []
+    last = messages[-1].get("content") if messages else ""
+    if isinstance(last, list):
+        last = " ".join(part.get("text", "") for part in last if isinstance(part, dict))
+    text = (last or "").strip()
+    first_line = text.splitlines()[0][:80] if text else ""
+    return f"Stub response to: {first_line}"
+
+def _message_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            parts += [part.get("text", "") for part in content if isinstance(part, dict)]
+        elif content:
+            parts.append(str(content))
+    if body.get("tools"):
+        parts.append(json.dumps(body["tools"]))
+    return "\n".join(parts) or str(body.get("prompt", ""))
+
+class StubOpenAIServer:
+    """Threaded OpenAI-compatible HTTP server.
+
+    Every request waits `latency` seconds, plus up to `jitter` more, plus
+    `seconds_per_token` per completion token. With probability `error_rate`
+    it fails instead, with a status drawn from `error_statuses` (429s carry a
+    `Retry-After` of `retry_after` seconds). Token usage is reported with the
+    same estimate the rest of the repo budgets with, so telemetry works.
+    """
+
+    def __init__(self, host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 seconds_per_token: float = 0.0,
+                 error_rate: float = 0.0,
+                 error_statuses: Sequence[int] = (429, 500, 503),
+                 retry_after: float = 0.0,
+                 responder: Optional[Responder] = None,
+                 seed: Optional[int] = None):
+        assert latency >= 0 and jitter >= 0 and seconds_per_token >= 0, "Latencies must be non-negative."
+        assert 0 <= error_rate <= 1, "error_rate must be in [0, 1]."
+        assert error_statuses, "error_statuses must not be empty."
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.seconds_per_token = seconds_per_token
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.responder = responder or default_responder
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._n_responses = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"requests": 0, "errors_injected": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    @property
+    def url(self) -> str:
+        """Base URL to hand to the clients, e.g. as `OPENAI_BASE_URL`."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    def environ(self, model: str = DFT_STUB_MODEL) -> Dict[str, str]:
+        """Environment variables that point `configure_openai` and llama_index
+        at this server."""
+        return {
+            "OPENAI_BASE_URL": self.url,  # openai SDK
+            "OPENAI_API_BASE": self.url,  # llama_index
+            "OPENAI_API_KEY": "sk-stub",
+            "DEV_OPENAI_MODEL_ID": model,
+        }
+
+    def start(self) -> "StubOpenAIServer":
+        handler = type("StubHandler", (_StubHandler,), {"stub": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        # With port=0 the OS picked a free one
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server, self._thread = None, None
+
+    def __enter__(self) -> "StubOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    ###########################
+    ######## RESPONSES ########
+    ###########################
+
+    def respond(self, path: str, body: dict) -> Tuple[int, dict, Dict[str, str]]:
+        """(status, JSON body, extra headers) for a request; also sleeps for
+        the simulated latency."""
+        with self._lock:
+            self.stats["requests"] += 1
+            fail = self._random.random() < self.error_rate
+            status = self._random.choice(self.error_statuses) if fail else 200
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            self._n_responses += 1
+            response_id = f"stub-{self._n_responses}"
+
+        if fail:
+            with self._lock:
+                self.stats["errors_injected"] += 1
+            time.sleep(delay)
+            headers = {"Retry-After": f"{self.retry_after:g}"} if status == 429 else {}
+            return status, {"error": {"message": f"Injected {status} from the stub server.",
+                                      "type": "rate_limit_error" if status == 429 else "server_error",
+                                      "code": None}}, headers
+
+        if body.get("stream"):
+            return 400, {"error": {"message": "The stub server doesn't stream.", "type": "invalid_request_error"}}, {}
+        if path.endswith("/chat/completions"):
+            payload = self._chat_completion(body, response_id)
+        elif path.endswith("/completions"):
+            payload = self._completion(body, response_id)
+        else:
+            return 404, {"error": {"message": f"Unknown endpoint {path}.", "type": "invalid_request_error"}}, {}
+
+        usage = payload["usage"]
+        with self._lock:
+            self.stats["prompt_tokens"] += usage["prompt_tokens"]
+            self.stats["completion_tokens"] += usage["completion_tokens"]
+        time.sleep(delay + usage["completion_tokens"] * self.seconds_per_token)
+        return 200, payload, {}
+
+    def _chat_completion(self, body: dict, response_id: str) -> dict:
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        tools = body.get("tools") or []
+        tool_choice = body.get("tool_choice")
+        if tools and tool_choice != "none":
+            # Call the requested tool, or else the first one, with minimal valid arguments
+            name = tool_choice["function"]["name"] if isinstance(tool_choice, dict) else tools[0]["function"]["name"]
+            tool = next(t for t in tools if t["function"]["name"] == name)
+            arguments = json.dumps(example_from_schema(tool["function"].get("parameters", {})))
+            message["tool_calls"] = [{"id": f"call_{response_id}", "type": "function",
+                                      "function": {"name": name, "arguments": arguments}}]
+            finish_reason = "tool_calls"
+            completion_text = arguments
+        else:
+            message["content"] = completion_text = self.responder(body)
+        return {
+            "id": f"chatcmpl-{response_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", DFT_STUB_MODEL),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": self._usage(body, completion_text),
+        }
+
+    def _completion(self, body: dict, response_id: str) -> dict:
+        text = self.responder({"messages": [{"role": "user", "content": str(body.get("prompt", ""))}]})
+        return {
+            "id": f"cmpl-{response_id}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model", DFT_STUB_MODEL),
+            "choices": [{"index": 0, "text": text, "finish_reason": "stop", "logprobs": None}],
+            "usage": self._usage(body, text),
+        }
+
+    @staticmethod
+    def _usage(body: dict, completion_text: str) -> dict:
+        prompt_tokens, completion_tokens = estimate_tokens(_message_text(body)), estimate_tokens(completion_text)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+class _StubHandler(BaseHTTPRequestHandler):
+    stub: StubOpenAIServer
+    # Keep-alive, so pooled clients behave as they would against the real API
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0].endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": DFT_STUB_MODEL, "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send(404, {"error": {"message": f"Unknown endpoint {self.path}.", "type": "invalid_request_error"}})
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._send(400, {"error": {"message": "Body is not valid JSON.", "type": "invalid_request_error"}})
+            return
+        status, payload, headers = self.stub.respond(self.path.split("?")[0], body)
+        self._send(status, payload, headers)
+
+    def _send(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        # One line per request would drown out the pipeline's own output
+        pass
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every request waits.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, uniformly.")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="Extra seconds per completion token.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail.")
+    parser.add_argument("--error-statuses", type=int, nargs="+", default=[429, 500, 503])
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds on injected 429s.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+                              seconds_per_token=args.seconds_per_token, error_rate=args.error_rate,
+                              error_statuses=args.error_statuses, retry_after=args.retry_after, seed=args.seed)
+    server.start()
+    print(f"Stub OpenAI server listening on {server.url}. Point the clients at it with:")
+    for name, value in server.environ().items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(server.stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+### TELEMETRY
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+DFT_TELEMETRY_DIR = ".cache/telemetry"
+
+# USD per 1M (prompt, completion) tokens, matched on the longest model-name
+# prefix. List prices at the time of writing; pass `prices=` to override.
+DFT_MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Calls are attributed to whatever stage/loop is active in the caller's
+# context. Context variables follow the call into `run_sync`'s background
+# loop and `asyncio.to_thread`; plain executors need `copy_context().run`.
+_STAGE: ContextVar[str] = ContextVar("llm_stage", default="unattributed")
+_LOOP: ContextVar[Optional[int]] = ContextVar("llm_loop", default=None)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Attributes every LLM call made inside the block to stage `name`."""
+    token = _STAGE.set(name)
+    try:
+        yield
+    finally:
+        _STAGE.reset(token)
+
+@contextmanager
+def loop(n: int) -> Iterator[None]:
+    """Attributes every LLM call made inside the block to `core.run` loop `n`."""
+    token = _LOOP.set(n)
+    try:
+        yield
+    finally:
+        _LOOP.reset(token)
+
+def _field(obj: Any, name: str) -> Any:
+    # Responses may be SDK objects or plain dicts (e.g. replayed from disk)
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def usage_of(response: Any) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, completion_tokens) from an OpenAI response, if reported."""
+    usage = _field(response, "usage")
+    if usage is None:
+        return None
+    return _field(usage, "prompt_tokens") or 0, _field(usage, "completion_tokens") or 0
+
+class Telemetry:
+    """Per-call record of every LLM request, with per-stage/per-loop rollups.
+
+    Each call records its model, prompt/completion tokens, wall time
+    (including retries and backoff), number of retries, whether it was served
+    from cache, and an estimated cost. `summary` aggregates the calls by any
+    of the recorded fields; `export_jsonl` and `export_prometheus` write them
+    out for offline analysis or scraping.
+    """
+
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.prices = DFT_MODEL_PRICES if prices is None else prices
+        self._lock = threading.Lock()
+        self._calls: List[dict] = []
+
+    def record(self, model: Optional[str],
+               prompt_tokens: int = 0,
+               completion_tokens: int = 0,
+               seconds: float = 0.0,
+               retries: int = 0,
+               cache_hit: bool = False,
+               succeeded: bool = True,
+               source: str = "prompt_LLM") -> dict:
+        call = {
+            "ts": time.time(),
+            "source": source,
+            "stage": _STAGE.get(),
+            "loop": _LOOP.get(),
+            "model": model or "unknown",
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "seconds": seconds,
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "succeeded": succeeded,
+            "cost_usd": self.cost(model, prompt_tokens, completion_tokens),
+        }
+        with self._lock:
+            self._calls.append(call)
+        return call
+
+    def cost(self, model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+        matches = [name for name in self.prices if model and model.startswith(name)]
+        if not matches:
+            return 0.0
+        prompt_price, completion_price = self.prices[max(matches, key=len)]
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+    def calls(self) -> List[dict]:
+        with self._lock:
+            return list(self._calls)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._calls = []
+
+    def summary(self, by: Union[str, Tuple[str, ...]] = "stage") -> Dict[Any, dict]:
+        """Aggregates calls by one or more recorded fields, e.g. "stage",
+        "loop", "model" or ("loop", "stage")."""
+        keys = (by,) if isinstance(by, str) else tuple(by)
+        groups = defaultdict(lambda: {"calls": 0, "cache_hits": 0, "failures": 0, "retries": 0,
+                                      "prompt_tokens": 0, "completion_tokens": 0,
+                                      "seconds": 0.0, "max_seconds": 0.0, "cost_usd": 0.0})
+        for call in self.calls():
+            group = groups[call[keys[0]] if len(keys) == 1 else tuple(call[key] for key in keys)]
+            group["calls"] += 1
+            group["cache_hits"] += call["cache_hit"]
+            group["failures"] += not call["succeeded"]
+            group["retries"] += call["retries"]
+            group["prompt_tokens"] += call["prompt_tokens"]
+            group["completion_tokens"] += call["completion_tokens"]
+            group["seconds"] += call["seconds"]
+            group["max_seconds"] = max(group["max_seconds"], call["seconds"])
+            group["cost_usd"] += call["cost_usd"]
+        for group in groups.values():
+            group["mean_seconds"] = group["seconds"] / group["calls"]
+        return dict(groups)
+
+    def report(self, by: Union[str, Tuple[str, ...]] = "stage") -> str:
+        lines = [f"{'':<28} {'calls':>6} {'cached':>6} {'retries':>7} {'prompt tok':>10} {'compl tok':>10} {'seconds':>9} {'cost $':>8}"]
+        for key, group in sorted(self.summary(by).items(), key=lambda item: str(item[0])):
+            lines.append(f"{str(key):<28} {group['calls']:>6} {group['cache_hits']:>6} {group['retries']:>7} "
+                         f"{group['prompt_tokens']:>10} {group['completion_tokens']:>10} "
+                         f"{group['seconds']:>9.2f} {group['cost_usd']:>8.4f}")
+        return "\n".join(lines)
+
+    def export_jsonl(self, path: Optional[str] = None) -> str:
+        """One JSON object per call. Written to `path` (appending) if given."""
+        text = "".join(json.dumps(call) + "\n" for call in self.calls())
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a") as f:
+                f.write(text)
+        return text
+
+    def export_prometheus(self, path: Optional[str] = None) -> str:
+        """Prometheus text exposition format, labelled by stage, loop and model.
+        Written to `path` (overwriting) if given, e.g. for node_exporter's
+        textfile collector."""
+        metrics = (
+            ("llm_calls_total", "counter", "LLM calls, including cache hits.", "calls"),
+            ("llm_cache_hits_total", "counter", "LLM calls served from the response cache.", "cache_hits"),
+            ("llm_failures_total", "counter", "LLM calls that never produced a valid response.", "failures"),
+            ("llm_retries_total", "counter", "Transport and validation retries.", "retries"),
+            ("llm_prompt_tokens_total", "counter", "Prompt tokens billed.", "prompt_tokens"),
+            ("llm_completion_tokens_total", "counter", "Completion tokens billed.", "completion_tokens"),
+            ("llm_latency_seconds_sum", "counter", "Wall time spent in LLM calls, including backoff.", "seconds"),
+            ("llm_cost_usd_total", "counter", "Estimated cost in USD.", "cost_usd"),
+        )
+        summary = self.summary(by=("stage", "loop", "model"))
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (stage_name, loop_n, model), group in sorted(summary.items(), key=lambda item: str(item[0])):
+                labels = f'stage="{stage_name}",loop="{"" if loop_n is None else loop_n}",model="{model}"'
+                lines.append(f"{name}{{{labels}}} {group[field]}")
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+TELEMETRY = Telemetry()
+
+class CallMeter:
+    """Accumulates one `prompt_LLM` call across all of its attempts.
+
+    Every attempt is billed, so usage is summed over validation retries too.
+    """
+
+    def __init__(self, model: str, telemetry: Optional[Telemetry] = None):
+        self.model = model
+        self.telemetry = telemetry or TELEMETRY
+        self.attempts = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._start = time.perf_counter()
+
+    def attempt(self) -> None:
+        self.attempts += 1
+
+    def add_response(self, response: Any) -> None:
+        usage = usage_of(response)
+        if usage is not None:
+            self.prompt_tokens += usage[0]
+            self.completion_tokens += usage[1]
+        # The served model (e.g. behind an Azure deployment name) prices the call
+        self.model = _field(response, "model") or self.model
+
+    def finish(self, succeeded: bool, cache_hit: bool = False) -> dict:
+        return self.telemetry.record(self.model,
+                                     prompt_tokens=self.prompt_tokens,
+                                     completion_tokens=self.completion_tokens,
+                                     seconds=time.perf_counter() - self._start,
+                                     retries=max(self.attempts - 1, 0),
+                                     cache_hit=cache_hit,
+                                     succeeded=succeeded)
+
+### llama_index calls
+
+_LLAMA_INDEX_HANDLER = None
+_INSTRUMENT_LOCK = threading.Lock()
+
+def instrument_llama_index(telemetry: Optional[Telemetry] = None) -> None:
+    """Records every llama_index LLM call (chat and completion) in `telemetry`.
+
+    Hooks llama_index's instrumentation dispatcher, so query engines and
+    structured LLMs are covered without wrapping them. Only calls whose
+    response reports token usage are recorded; wrappers such as
+    `as_structured_llm` emit their own events around the inner call, and
+    counting those too would double count. Idempotent.
+    """
+    global _LLAMA_INDEX_HANDLER
+    telemetry = telemetry or TELEMETRY
+    with _INSTRUMENT_LOCK:
+        if _LLAMA_INDEX_HANDLER is not None:
+            return
+        # Imported here; the rest of this module doesn't need llama_index
+        from llama_index.core.instrumentation import get_dispatcher
+        from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+        from llama_index.core.instrumentation.events.llm import (
+            LLMChatEndEvent, LLMChatStartEvent, LLMCompletionEndEvent, LLMCompletionStartEvent,
+        )
+
+        # span_id -> (start time, requested model)
+        started: Dict[str, Tuple[float, Optional[str]]] = {}
+
+        class _LLMEventHandler(BaseEventHandler):
+            @classmethod
+            def class_name(cls) -> str:
+                return "TelemetryLLMEventHandler"
+
+            def handle(self, event, **kwargs) -> None:
+                if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+                    started[event.span_id] = (time.perf_counter(), (event.model_dict or {}).get("model"))
+                elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+                    start, model = started.pop(event.span_id, (None, None))
+                    response = event.response
+                    if response is None:
+                        return
+                    counts = response.additional_kwargs or {}
+                    if "prompt_tokens" in counts:
+                        usage = counts.get("prompt_tokens") or 0, counts.get("completion_tokens") or 0
+                    else:
+                        usage = usage_of(response.raw) if response.raw is not None else None
+                    if usage is None:
+                        return
+                    served_model = _field(response.raw, "model") if response.raw is not None else None
+                    telemetry.record(served_model or model,
+                                     prompt_tokens=usage[0],
+                                     completion_tokens=usage[1],
+                                     seconds=time.perf_counter() - start if start is not None else 0.0,
+                                     source="llama_index")
+
+        _LLAMA_INDEX_HANDLER = _LLMEventHandler()
+        get_dispatcher().add_event_handler(_LLAMA_INDEX_HANDLER)
@@ -0,0 +1,257 @@
+### RECORD/REPLAY TRANSPORT
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import weakref
+from typing import Callable, Literal, Optional, Union
+
+import httpx
+
+from sray_ValidatedLLM.modules.constants import DataConstants
+
+TransportMode = Literal["record", "replay", "auto"]
+TRANSPORT_MODES = ("record", "replay", "auto")
+
+# Picked up by `shared_http_client` when `configure_transport` wasn't called
+ENV_TRANSPORT_MODE = "LLM_TRANSPORT"
+ENV_CASSETTE_DIR = "LLM_CASSETTE_DIR"
+
+# Only a few response headers matter to the SDKs; the rest (dates, request
+# ids, rate-limit counters) would just make recordings noisy
+_KEPT_HEADERS = ("content-type",)
+
+class ReplayMissError(httpx.TransportError):
+    """Raised in "replay" mode for a request that was never recorded."""
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """SHA-256 of the method, path and (canonicalized JSON) body.
+
+    Deliberately leaves out the host and headers, so a recording made against
+    one endpoint replays against another and no credentials end up in it.
+    """
+    try:
+        body_text = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        body_text = body.decode("utf-8", errors="replace")
+    payload = json.dumps([method.upper(), path, body_text])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class Cassette:
+    """A directory of recorded responses, one JSON file per request key."""
+
+    def __init__(self, cassette_dir: str = DataConstants.DFT_CASSETTE_DIR):
+        self.cassette_dir = cassette_dir
+        os.makedirs(cassette_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {"replayed": 0, "recorded": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["replayed"] += 1
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        path = self._path(key)
+        # Write atomically so a crash never leaves a truncated entry behind
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stats["recorded"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cassette_dir, f"{key}.json")
+
+class _Recorder:
+    # Shared by the sync and async transports
+
+    def __init__(self, mode: TransportMode, cassette: Cassette):
+        assert mode in TRANSPORT_MODES, f"mode must be one of {TRANSPORT_MODES}, not {mode!r}."
+        self.mode = mode
+        self.cassette = cassette
+
+    def _key(self, request: httpx.Request) -> str:
+        return request_key(request.method, request.url.raw_path.decode("ascii"), request.content)
+
+    def _lookup(self, request: httpx.Request, key: str) -> Optional[httpx.Response]:
+        if self.mode == "record":
+            return None
+        entry = self.cassette.get(key)
+        if entry is None:
+            if self.mode == "replay":
+                raise ReplayMissError(f"No recording for {request.method} {request.url.path} "
+                                      f"(key {key[:12]}) in {self.cassette.cassette_dir}.", request=request)
+            return None
+        return httpx.Response(entry["status"], headers=entry["headers"],
+                              content=entry["body"].encode("utf-8"), request=request)
+
+    def _store(self, request: httpx.Request, key: str, response: httpx.Response) -> httpx.Response:
+        # Transient failures are retried by the caller and shouldn't be replayed forever
+        if response.status_code < 500 and response.status_code != 429:
+            self.cassette.put(key, {
+                "request": {"method": request.method, "path": request.url.path,
+                            "body": request.content.decode("utf-8", errors="replace")},
+                "status": response.status_code,
+                "headers": {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers},
+                "body": response.text,
+            })
+        # The body has been read (and decompressed), so the encoding headers no longer apply
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(response.status_code, headers=headers, content=response.content, request=request)
+
+class RecordReplayTransport(_Recorder, httpx.BaseTransport):
+    """httpx transport that records every response to a `Cassette` and/or
+    serves requests from it.
+
+    Modes:
+        "record": always forward to `inner` and record the response.
+        "replay": only ever serve recordings; unknown requests raise `ReplayMissError`.
+        "auto":   serve recordings, forwarding (and recording) the misses.
+    """
+
+    def __init__(self, mode: TransportMode, cassette: Cassette, inner: Optional[httpx.BaseTransport] = None):
+        super().__init__(mode, cassette)
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        key = self._key(request)
+        replayed = self._lookup(request, key)
+        if replayed is not None:
+            return replayed
+        if self.inner is None:
+            self.inner = httpx.HTTPTransport()
+        response = self.inner.handle_request(request)
+        try:
+            response.read()
+        finally:
+            response.close()
+        return self._store(request, key, response)
+
+    def close(self) -> None:
+        if self.inner is not None:
+            self.inner.close()
+
+class AsyncRecordReplayTransport(_Recorder, httpx.AsyncBaseTransport):
+    """Async counterpart of `RecordReplayTransport`."""
+
+    def __init__(self, mode: TransportMode, cassette: Cassette, inner: Optional[httpx.AsyncBaseTransport] = None):
+        super().__init__(mode, cassette)
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key = self._key(request)
+        replayed = self._lookup(request, key)
+        if replayed is not None:
+            return replayed
+        if self.inner is None:
+            self.inner = httpx.AsyncHTTPTransport()
+        response = await self.inner.handle_async_request(request)
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        return self._store(request, key, response)
+
+    async def aclose(self) -> None:
+        if self.inner is not None:
+            await self.inner.aclose()
+
+### Per-loop async pools
+
+class LoopLocalAsyncClient(httpx.AsyncClient):
+    """An `httpx.AsyncClient` with one connection pool per event loop.
+
+    Pooled connections belong to the loop that opened them, so a plain
+    shared AsyncClient breaks ("attached to a different loop", "Event loop is
+    closed") as soon as a second loop uses it, e.g. `asyncio.run(aprompt_LLM(...))`
+    after `run_sync`'s background loop. This client only builds requests;
+    `send` goes through a client belonging to the running loop, made by
+    `factory` on first use and dropped with the loop.
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncClient], **kwargs):
+        super().__init__(**kwargs)
+        self._factory = factory
+        self._loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._loop_clients_lock = threading.Lock()
+
+    def loop_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._loop_clients_lock:
+            client = self._loop_clients.get(loop)
+            if client is None:
+                client = self._loop_clients[loop] = self._factory()
+            return client
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self.loop_client().send(request, **kwargs)
+
+    async def aclose(self) -> None:
+        # Only the running loop's pool can be closed from here; the others go with their loops
+        with self._loop_clients_lock:
+            client = self._loop_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+        await super().aclose()
+
+### Process-wide setting
+
+_MODE: Optional[TransportMode] = None
+_CASSETTE: Optional[Cassette] = None
+_CONFIGURED = False
+_LOCK = threading.Lock()
+
+def configure_transport(mode: Optional[TransportMode], cassette_dir: str = DataConstants.DFT_CASSETTE_DIR) -> None:
+    """Records and/or replays every request made through `shared_http_client`
+    (so every client from `configure_openai`, plus llama_index's `OpenAI` in
+    `GapFinder`/`Designer`). Pass `mode=None` for plain network access.
+
+    Must be called before the shared clients are first built; they keep the
+    transport they were built with. Without a call, the `LLM_TRANSPORT` and
+    `LLM_CASSETTE_DIR` environment variables are used.
+    """
+    global _MODE, _CASSETTE, _CONFIGURED
+    assert mode is None or mode in TRANSPORT_MODES, f"mode must be one of {TRANSPORT_MODES} or None, not {mode!r}."
+    with _LOCK:
+        _MODE = mode
+        _CASSETTE = Cassette(cassette_dir) if mode is not None else None
+        _CONFIGURED = True
+
+def cassette() -> Optional[Cassette]:
+    """The cassette requests are recorded to/replayed from, if any."""
+    _configure_from_env()
+    return _CASSETTE
+
+def recording() -> bool:
+    """Whether requests are being recorded and/or replayed."""
+    _configure_from_env()
+    return _MODE is not None
+
+def wrap_transport(inner: Union[httpx.BaseTransport, httpx.AsyncBaseTransport]) -> Union[httpx.BaseTransport, httpx.AsyncBaseTransport]:
+    """`inner`, wrapped for recording/replaying if that's been configured."""
+    _configure_from_env()
+    if _MODE is None:
+        return inner
+    if isinstance(inner, httpx.AsyncBaseTransport):
+        return AsyncRecordReplayTransport(_MODE, _CASSETTE, inner=inner)
+    return RecordReplayTransport(_MODE, _CASSETTE, inner=inner)
+
+def _configure_from_env() -> None:
+    if _CONFIGURED:
+        return
+    mode = os.environ.get(ENV_TRANSPORT_MODE) or None
+    configure_transport(mode, os.environ.get(ENV_CASSETTE_DIR, DataConstants.DFT_CASSETTE_DIR))
@@ -3,12 +3,17 @@
 import os
 import json
 import base64
-from typing import Literal, Union
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Literal, Optional, Union
 
 from sray_ValidatedLLM.modules.constants import DataConstants
 
-import openai
-from openai import AzureOpenAI, OpenAI, AsyncOpenAI
+# The openai SDK (and httpx under it) are only needed once a client is built,
+# so modules that just want `fmt` & co. don't pay for importing them.
+if TYPE_CHECKING:
+    import httpx
+    from openai import AzureOpenAI, OpenAI, AsyncOpenAI
 
 ### COLORS
 
@@ -62,6 +67,10 @@ def wrap_for_unpacking(thing) -> tuple:
     else:
         return (thing,)
 
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English; good enough for budgeting
+    return len(text) // 4 + 1
+
 ### OpenAI Client Setup
 
 def get_credentials(mid_req_by_user: str) -> dict:
@@ -136,9 +145,75 @@ def get_credentials(mid_req_by_user: str) -> dict:
     
     return credentials
 
-def configure_openai(model_id_to_use: str, client_host: Literal["openai", "azureopenai", "openai-async"]) -> tuple[Union[AzureOpenAI, OpenAI], str]:
+### Shared Connection Pools
+
+_HTTP_CLIENTS = {}
+# (client_host, endpoint, api_version, credentials hash, model_id) -> (client, model_id)
+_OPENAI_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def shared_http_client(is_async: bool = False) -> Union["httpx.Client", "httpx.AsyncClient"]:
+    """The process-wide httpx client behind every pooled OpenAI client.
+
+    Pass it as `http_client` (or `async_http_client`) to anything else that
+    talks to the same hosts, e.g. llama_index's `OpenAI`, so all stages reuse
+    one set of warm keep-alive connections instead of each paying for its own
+    TLS handshakes. Pooled connections are bound to the event loop that opened
+    them, so the async client keeps one pool per loop: it works from
+    `run_sync`'s background loop and from caller-owned loops (`asyncio.run`)
+    alike.
+
+    Requests go through the record/replay transport when one is configured
+    (SEE `modules/transport.py`).
+    """
+    from sray_ValidatedLLM.modules.transport import LoopLocalAsyncClient
+    with _CLIENTS_LOCK:
+        if is_async not in _HTTP_CLIENTS:
+            if is_async:
+                _HTTP_CLIENTS[is_async] = LoopLocalAsyncClient(lambda: _new_http_client(is_async=True),
+                                                               timeout=DataConstants.DFT_HTTP_TIMEOUT)
+            else:
+                _HTTP_CLIENTS[is_async] = _new_http_client(is_async=False)
+        return _HTTP_CLIENTS[is_async]
+
+def _new_http_client(is_async: bool) -> Union["httpx.Client", "httpx.AsyncClient"]:
+    import httpx
+    from sray_ValidatedLLM.modules.transport import recording, wrap_transport
+    limits = httpx.Limits(max_connections=DataConstants.DFT_HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=DataConstants.DFT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                          keepalive_expiry=DataConstants.DFT_HTTP_KEEPALIVE_EXPIRY)
+    client_cls = httpx.AsyncClient if is_async else httpx.Client
+    if not recording():
+        # Let httpx build its own transports, so HTTP(S)_PROXY/NO_PROXY still apply
+        return client_cls(limits=limits, timeout=DataConstants.DFT_HTTP_TIMEOUT)
+    # A custom transport ignores the client's `limits` and the proxy variables,
+    # so the pool lives on the transport and the proxy is passed explicitly
+    transport_cls = httpx.AsyncHTTPTransport if is_async else httpx.HTTPTransport
+    proxy = _env_proxy()
+    inner = transport_cls(limits=limits, proxy=proxy) if proxy else transport_cls(limits=limits)
+    return client_cls(transport=wrap_transport(inner), timeout=DataConstants.DFT_HTTP_TIMEOUT)
+
+def _env_proxy() -> Optional[str]:
+    # The proxy httpx would have picked for the OpenAI endpoint
+    import urllib.request
+    base_url = os.environ.get("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+    host = base_url.split("://", 1)[-1].split("/", 1)[0]
+    if urllib.request.proxy_bypass(host.split(":", 1)[0]):
+        return None
+    proxies = urllib.request.getproxies()
+    return proxies.get(base_url.split("://", 1)[0]) or proxies.get("all")
+
+def _hash_secret(secret: str) -> str:
+    # Keys the registry on credentials without keeping them in another place
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+def configure_openai(model_id_to_use: str, client_host: Literal["openai", "azureopenai", "openai-async"], reuse: bool = True) -> tuple[Union["AzureOpenAI", "OpenAI", "AsyncOpenAI"], str]:
     """Configure the OpenAI client and retrieve the model ID.
 
+    Clients are pooled: calls with the same host, endpoint, credentials and model get
+    the same client back, and every client shares the connection pool from
+    `shared_http_client`. Pass `reuse=False` for a private client.
+
     Raises:
         Exception: If any of the required credentials are missing.
 
@@ -150,22 +225,46 @@ def configure_openai(model_id_to_use: str, client_host: Literal["openai", "azure
     # assert model_id_to_use in DataConstants.DFT_MODEL_IDS_SUPPORTED, f"Model ID {model_id_to_use} is not supported. Supported model IDs are {DataConstants.DFT_MODEL_IDS_SUPPORTED}."
     
     _credentials = None
-    if client_host == "openai":
-        client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        model_id = os.environ["DEV_OPENAI_MODEL_ID"]
-    elif client_host == "openai-async":
-        client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    if client_host in ("openai", "openai-async"):
+        api_key = os.environ["OPENAI_API_KEY"]
         model_id = os.environ["DEV_OPENAI_MODEL_ID"]
+        # The SDK reads OPENAI_BASE_URL when the client is built, so a client
+        # built for one endpoint must not be handed out for another
+        registry_key = (client_host, os.environ.get("OPENAI_BASE_URL"), None, _hash_secret(api_key), model_id)
     elif client_host == "azureopenai":
         _credentials = get_credentials(mid_req_by_user=model_id_to_use)
         try:
+            api_key = _credentials['AZURE_OPENAI_API_KEY']
             model_id = _credentials[model_id_to_use]
-            client = AzureOpenAI(api_key=_credentials['AZURE_OPENAI_API_KEY'],  
-                                api_version=_credentials['AZURE_OPENAI_API_VERSION'],
-                                azure_endpoint=_credentials['AZURE_OPENAI_ENDPOINT'])
+            registry_key = (client_host, _credentials['AZURE_OPENAI_ENDPOINT'], _credentials['AZURE_OPENAI_API_VERSION'],
+                            _hash_secret(api_key), model_id)
         except KeyError:
             raise Exception("Please check your credentials file. Should have all keys requested in this function.")
     
+    if reuse:
+        with _CLIENTS_LOCK:
+            if registry_key in _OPENAI_CLIENTS:
+                return _OPENAI_CLIENTS[registry_key]
+    
+    from openai import AzureOpenAI, OpenAI, AsyncOpenAI
+    
+    # `prompt_LLM`'s retry engine owns retries (SEE `modules/retry.py`), so the
+    # SDK's own retries are turned off to avoid multiplying attempts
+    if client_host == "openai":
+        client = OpenAI(api_key=api_key, max_retries=0, http_client=shared_http_client())
+    elif client_host == "openai-async":
+        client = AsyncOpenAI(api_key=api_key, max_retries=0, http_client=shared_http_client(is_async=True))
+    elif client_host == "azureopenai":
+        client = AzureOpenAI(api_key=api_key,
+                             api_version=_credentials['AZURE_OPENAI_API_VERSION'],
+                             azure_endpoint=_credentials['AZURE_OPENAI_ENDPOINT'],
+                             max_retries=0,
+                             http_client=shared_http_client())
+    
+    if reuse:
+        with _CLIENTS_LOCK:
+            # Another thread may have raced us here; keep whichever landed first
+            return _OPENAI_CLIENTS.setdefault(registry_key, (client, model_id))
     return client, model_id
 
 ### Pre-LLM Call Utilities
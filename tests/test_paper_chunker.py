@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from Modules.PaperChunker import _section_title, split_sections
+
+
+@pytest.mark.parametrize("line", ["3 Method", "2.1 Datasets", "A.2 Proofs", "IV. RESULTS", "Related Work", "References"])
+def test_headings(line):
+    assert _section_title(line) is not None
+
+
+@pytest.mark.parametrize("line", [
+    # Table rows
+    "1 Baseline 0.45 0.67",
+    "2 BERT-base 81.2 79.4",
+    # Line-numbered or wrapped sentences
+    "5 Table 3 shows that the",
+    "12 We propose a new",
+    "7 Results are reported in",
+])
+def test_not_headings(line):
+    assert _section_title(line) is None
+
+
+def test_numbered_headings_must_stand_alone():
+    text = (
+        "1 Introduction\n"
+        "Large models are expensive to train and\n"
+        "12 We propose a new way to train them\n"
+        "\n"
+        "Table 1: Accuracy per model.\n"
+        "Model Dev Test\n"
+        "1 Baseline 0.45 0.67\n"
+        "2 BERT-base 81.2 79.4\n"
+        "\n"
+        "2 Method\n"
+        "2.1 Datasets\n"
+        "We use two corpora.\n"
+    )
+    headings = [heading for heading, _ in split_sections(text)]
+    assert headings == ["1 Introduction", "2 Method", "2.1 Datasets"]
+
+    sections = dict(split_sections(text))
+    assert "12 We propose a new way to train them" in sections["1 Introduction"]
+    assert "2 BERT-base 81.2 79.4" in sections["1 Introduction"]